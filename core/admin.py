@@ -1,8 +1,12 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.utils.html import format_html
 from .models import (
     Profile, Category, Outfit, OutfitImage,
-    Order, OrderItem, Review, Notification, Message, Cart, Wishlist, Compare
+    Order, OrderItem, Review, Notification, Message, Cart, Wishlist, Compare,
+    MediaJob,
 )
+from . import jobs, lifecycle, search
+from .templatetags.responsive_images import resized_url
 
 
 @admin.register(Profile)
@@ -31,10 +35,23 @@ class CategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Outfit)
 class OutfitAdmin(admin.ModelAdmin):
-    list_display = ('name', 'designer', 'price', 'is_active')
+    list_display = ('thumbnail', 'name', 'designer', 'price', 'stock', 'reserved', 'is_active')
+    readonly_fields = ('reserved',)
     list_filter = ('is_active', 'category')
     search_fields = ('name', 'description')
 
+    @admin.display(description="")
+    def thumbnail(self, obj):
+        if not obj.image:
+            return ''
+        return format_html('<img src="{}" width="48" height="48" alt="">', resized_url(obj.image, '96x96'))
+
+    def get_search_results(self, request, queryset, search_term):
+        # Use the full-text index instead of icontains scans over name/description
+        if not search_term:
+            return queryset, False
+        return search.filter_outfits(queryset, search_term), False
+
 
 
 @admin.register(Cart)
@@ -51,8 +68,55 @@ class CompareAdmin(admin.ModelAdmin):
 
 
 admin.site.register(OutfitImage)
-admin.site.register(Order)
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ('id', 'customer', 'status', 'total_amount', 'payment_method', 'created_at', 'review_reason')
+    list_filter = ('status', 'payment_method', ('review_reason', admin.EmptyFieldListFilter))
+    list_select_related = ('customer__user',)
+    # Status only changes through the actions below, so every move is a valid transition
+    readonly_fields = ('status', 'receipt', 'review_reason')
+    actions = ['mark_processing', 'mark_completed', 'mark_cancelled', 'mark_reviewed']
+
+    def apply_transition(self, request, queryset, target):
+        moved, skipped = lifecycle.transition(queryset, target)
+        label = dict(Order.STATUS_CHOICES)[target].lower()
+        message = f"{moved} order(s) marked {label}."
+        if skipped:
+            message += f" {skipped} skipped: their status doesn't allow it."
+        self.message_user(request, message, messages.SUCCESS if moved else messages.WARNING)
+
+    @admin.action(description="Mark selected orders as processing")
+    def mark_processing(self, request, queryset):
+        self.apply_transition(request, queryset, 'processing')
+
+    @admin.action(description="Mark selected orders as completed")
+    def mark_completed(self, request, queryset):
+        self.apply_transition(request, queryset, 'completed')
+
+    @admin.action(description="Cancel selected orders (restocks their items)")
+    def mark_cancelled(self, request, queryset):
+        self.apply_transition(request, queryset, 'cancelled')
+
+    @admin.action(description="Clear the review flag of selected orders (after refunding or reinstating)")
+    def mark_reviewed(self, request, queryset):
+        cleared = queryset.exclude(review_reason='').update(review_reason='')
+        self.message_user(request, f"{cleared} order(s) marked reviewed.")
+
 admin.site.register(OrderItem)
 admin.site.register(Review)
 admin.site.register(Notification)
 admin.site.register(Message)
+
+
+@admin.register(MediaJob)
+class MediaJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'source', 'status', 'attempts', 'run_after', 'worker', 'updated_at')
+    list_filter = ('status', 'kind')
+    search_fields = ('source',)
+    readonly_fields = [field.name for field in MediaJob._meta.fields]
+    actions = ['retry']
+
+    @admin.action(description="Queue the selected jobs again")
+    def retry(self, request, queryset):
+        queued = sum(jobs.enqueue(kind, source) for kind, source in queryset.values_list('kind', 'source').distinct())
+        self.message_user(request, f"{queued} job(s) queued again.")
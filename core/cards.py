@@ -0,0 +1,45 @@
+"""
+Cached rendering of outfit cards.
+
+The user-independent part of a card is rendered once per outfit version and
+reused by every listing page. A card's key includes updated_at (bumped by any
+save) plus the rating summary, which is updated with queryset.update() and so
+does not touch updated_at, and the designer's username, which lives on
+another row. All cards of a page are fetched with one get_many.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+
+def card_cache_key(outfit, template_name):
+    version = outfit.updated_at.timestamp() if outfit.updated_at else 0
+    # callers join designer__user, so this costs no query; hashed to keep the key short and safe
+    designer = outfit.designer.user.username if outfit.designer_id else ''
+    designer = hashlib.md5(designer.encode()).hexdigest()[:12]
+    return f'outfit_card:{template_name}:{outfit.pk}:{version}:{outfit.rating_count}:{outfit.rating_sum}:{designer}'
+
+
+def render_cards(outfits, template_name):
+    """Return [(outfit, html), ...], rendering only the cards missing from the cache."""
+    outfits = list(outfits)
+    keys = [card_cache_key(outfit, template_name) for outfit in outfits]
+    cached = cache.get_many(keys)
+
+    template = get_template(template_name)
+    missing = {}
+    cards = []
+    for outfit, key in zip(outfits, keys):
+        html = cached.get(key)
+        if html is None:
+            html = template.render({'outfit': outfit})
+            missing[key] = html
+        cards.append((outfit, mark_safe(html)))
+
+    if missing:
+        cache.set_many(missing, CACHE_TIMEOUT)
+    return cards
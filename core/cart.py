@@ -0,0 +1,454 @@
+"""
+Cart summary service.
+
+A user's cart summary (line count, total quantity, grand total) is computed
+with one SQL aggregate and cached per user, one integer key per figure (the
+total in cents). Cart mutations adjust the cached figures by the delta they
+applied with cache.incr() instead of re-summing the cart, so the quantity
+endpoints answer in constant time however big the cart is, and concurrent
+requests can't overwrite each other's changes.
+
+Carts live in one of two stores behind the same interface (get_cart()):
+UserCart keeps a signed-in shopper's lines in the Cart table, GuestCart keeps
+an anonymous shopper's lines in a signed cookie, so browsing and filling a
+cart writes nothing to the database. The guest lines are merged into the
+Cart table in bulk when the shopper logs in or signs up.
+"""
+import json
+from decimal import Decimal
+
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+
+from .models import Cart, Outfit
+
+CACHE_TIMEOUT = 60 * 60
+
+GUEST_COOKIE = 'guest_cart'
+GUEST_COOKIE_SALT = 'core.cart.guest'
+GUEST_COOKIE_AGE = 60 * 60 * 24 * 30
+# keeps the signed cookie well under the 4KB browser limit
+GUEST_MAX_LINES = 50
+
+LINE_TOTAL = ExpressionWrapper(
+    F('quantity') * F('outfit__price'),
+    output_field=DecimalField(max_digits=12, decimal_places=2),
+)
+
+
+SUMMARY_FIELDS = ('lines', 'quantity', 'total')
+CENT = Decimal('0.01')
+
+
+def summary_keys(user_id):
+    return [f'cart_summary:{user_id}:{field}' for field in SUMMARY_FIELDS]
+
+
+def cart_items(user):
+    """Cart rows with their outfit joined and the line subtotal computed in SQL."""
+    return (
+        Cart.objects.filter(user=user)
+        .select_related('outfit')
+        .annotate(line_total=LINE_TOTAL)
+        .order_by('added_at', 'pk')
+    )
+
+
+def compute_summary(user):
+    totals = Cart.objects.filter(user=user).aggregate(
+        line_count=Count('id'),
+        total_quantity=Sum('quantity'),
+        grand_total=Sum(LINE_TOTAL),
+    )
+    return {
+        'lines': totals['line_count'],
+        'quantity': totals['total_quantity'] or 0,
+        'total': (totals['grand_total'] or Decimal('0')).quantize(Decimal('0.01')),
+    }
+
+
+def summary_from_cache(values):
+    lines, quantity, cents = values
+    return {'lines': lines, 'quantity': quantity, 'total': (Decimal(cents) * CENT).quantize(CENT)}
+
+
+def recompute_summary(user):
+    """Summary from the database, cached unless another request got there first."""
+    summary = compute_summary(user)
+    cents = int(summary['total'] / CENT)
+    for key, value in zip(summary_keys(user.pk), (summary['lines'], summary['quantity'], cents)):
+        # add(), so a seed read before a concurrent change can't replace figures that include it
+        cache.add(key, value, CACHE_TIMEOUT)
+    return summary
+
+
+def get_summary(user):
+    keys = summary_keys(user.pk)
+    found = cache.get_many(keys)
+    if len(found) < len(keys):
+        return recompute_summary(user)
+    return summary_from_cache([found[key] for key in keys])
+
+
+def adjust_summary(user, quantity=0, amount=Decimal('0'), lines=0):
+    """
+    Apply a mutation's delta to the cached summary and return the new summary.
+    If any figure isn't cached the summary is recomputed from the database instead.
+    """
+    keys = summary_keys(user.pk)
+    try:
+        values = [
+            cache.incr(key, delta)
+            for key, delta in zip(keys, (lines, quantity, int(amount / CENT)))
+        ]
+    except ValueError:
+        # evicted (perhaps halfway through): start again from the database
+        cache.delete_many(keys)
+        return recompute_summary(user)
+    return summary_from_cache(values)
+
+
+def invalidate(user):
+    cache.delete_many(summary_keys(user.pk))
+
+
+def invalidate_for_outfit(outfit_id):
+    """Drop the cached summaries of every cart holding this outfit (e.g. after a price change)."""
+    user_ids = Cart.objects.filter(outfit_id=outfit_id).values_list('user_id', flat=True)
+    cache.delete_many([key for user_id in user_ids for key in summary_keys(user_id)])
+
+
+def check_stock(outfit, quantity):
+    if outfit.stock is not None and quantity > outfit.stock:
+        raise ValidationError(f"Only {outfit.stock} in stock.")
+
+
+OPERATIONS = ('set', 'add', 'remove')
+MAX_OPERATIONS = 100
+
+
+def parse_operations(operations):
+    """
+    Validate a batch of cart operations, e.g.
+    [{'op': 'set', 'outfit': 12, 'quantity': 3}, {'op': 'remove', 'outfit': 7}]
+    Returns [(op, outfit_id, quantity)]; raises ValidationError.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise ValidationError("Expected a non-empty list of operations.")
+    if len(operations) > MAX_OPERATIONS:
+        raise ValidationError(f"At most {MAX_OPERATIONS} operations per request.")
+    parsed = []
+    for operation in operations:
+        try:
+            op = operation['op']
+            outfit_id = int(operation['outfit'])
+            quantity = int(operation.get('quantity', 0 if op == 'remove' else 1))
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError(f"Malformed operation: {operation!r}")
+        if op not in OPERATIONS:
+            raise ValidationError(f"Unknown operation {op!r}.")
+        if (op == 'add' and quantity < 1) or (op == 'set' and quantity < 0):
+            raise ValidationError(f"Invalid quantity for outfit {outfit_id}.")
+        parsed.append((op, outfit_id, quantity))
+    return parsed
+
+
+def apply_operations(quantities, operations):
+    """Fold operations into {outfit_id: quantity}; 0 means the line goes away."""
+    quantities = dict(quantities)
+    for op, outfit_id, quantity in operations:
+        if op == 'set':
+            quantities[outfit_id] = quantity
+        elif op == 'add':
+            quantities[outfit_id] = quantities.get(outfit_id, 0) + quantity
+        else:
+            quantities[outfit_id] = 0
+    return quantities
+
+
+def check_batch(outfits, current, wanted):
+    missing = [outfit_id for outfit_id, quantity in wanted.items() if quantity and outfit_id not in outfits]
+    if missing:
+        raise ValidationError(f"Outfit {missing[0]} not found.")
+    for outfit_id, quantity in wanted.items():
+        if quantity > current.get(outfit_id, 0):
+            check_stock(outfits[outfit_id], quantity)
+
+
+def batch_lines(outfits, wanted):
+    """The touched lines as the batch endpoint reports them."""
+    return {
+        outfit_id: {
+            'quantity': quantity,
+            'subtotal': str(outfits[outfit_id].price * quantity) if quantity else '0.00',
+        }
+        for outfit_id, quantity in wanted.items()
+    }
+
+
+class UserCart:
+    """A signed-in shopper's cart, stored in the Cart table."""
+
+    def __init__(self, user):
+        self.user = user
+
+    def items(self):
+        return cart_items(self.user)
+
+    def summary(self, items=None):
+        if items is None:
+            return get_summary(self.user)
+        # rows the caller already loaded are the truth; the cached figures may lag them
+        total = sum((item.line_total for item in items), Decimal('0'))
+        return {
+            'lines': len(items),
+            'quantity': sum(item.quantity for item in items),
+            'total': total.quantize(CENT),
+        }
+
+    def add(self, outfit, quantity):
+        item, created = Cart.objects.get_or_create(
+            user=self.user,
+            outfit=outfit,
+            defaults={'quantity': quantity}
+        )
+        if not created:
+            Cart.objects.filter(pk=item.pk).update(quantity=F('quantity') + quantity)
+        return adjust_summary(self.user, quantity=quantity, amount=outfit.price * quantity, lines=int(created))
+
+    def change(self, item_id, delta):
+        """
+        Change a line's quantity by delta, removing it when it reaches zero.
+        Returns (line or None if removed, summary); raises Cart.DoesNotExist.
+        """
+        with transaction.atomic():
+            # locked, so two quick clicks both land instead of one overwriting the other
+            item = Cart.objects.select_for_update().select_related('outfit').get(id=item_id, user=self.user)
+            quantity = item.quantity + delta
+            if quantity < 1:
+                item.delete()
+            else:
+                if delta > 0:
+                    check_stock(item.outfit, quantity)
+                item.quantity = quantity
+                item.save(update_fields=['quantity'])
+        if quantity < 1:
+            return None, adjust_summary(self.user, quantity=-item.quantity, amount=-item.total_price, lines=-1)
+        item.line_total = item.total_price
+        return item, adjust_summary(self.user, quantity=delta, amount=item.outfit.price * delta)
+
+    def remove(self, item_id):
+        with transaction.atomic():
+            item = Cart.objects.select_for_update().select_related('outfit').get(id=item_id, user=self.user)
+            item.delete()
+        return adjust_summary(self.user, quantity=-item.quantity, amount=-item.total_price, lines=-1)
+
+    def batch(self, operations):
+        """
+        Apply parsed operations in one transaction: one read of the touched
+        rows, then at most one bulk_update, one bulk_create and one delete.
+        Returns (touched lines, summary).
+        """
+        outfit_ids = {outfit_id for _, outfit_id, _ in operations}
+        with transaction.atomic():
+            rows = {
+                item.outfit_id: item
+                for item in Cart.objects.select_for_update()
+                .filter(user=self.user, outfit_id__in=outfit_ids)
+                .select_related('outfit')
+            }
+            current = {outfit_id: item.quantity for outfit_id, item in rows.items()}
+            wanted = apply_operations(current, operations)
+            outfits = {outfit_id: item.outfit for outfit_id, item in rows.items()}
+            new_ids = [outfit_id for outfit_id, quantity in wanted.items() if quantity and outfit_id not in rows]
+            if new_ids:
+                outfits.update(Outfit.objects.in_bulk(new_ids))
+            check_batch(outfits, current, wanted)
+
+            changed, removed, created = [], [], []
+            for outfit_id, quantity in wanted.items():
+                item = rows.get(outfit_id)
+                if item is None:
+                    if quantity:
+                        created.append(Cart(user=self.user, outfit=outfits[outfit_id], quantity=quantity))
+                elif not quantity:
+                    removed.append(item.pk)
+                elif quantity != item.quantity:
+                    item.quantity = quantity
+                    changed.append(item)
+            if changed:
+                Cart.objects.bulk_update(changed, ['quantity'])
+            if created:
+                Cart.objects.bulk_create(created)
+            if removed:
+                Cart.objects.filter(pk__in=removed).delete()
+
+        summary = adjust_summary(
+            self.user,
+            quantity=sum(wanted[outfit_id] - current.get(outfit_id, 0) for outfit_id in wanted),
+            amount=sum(
+                (outfits[outfit_id].price * (wanted[outfit_id] - current.get(outfit_id, 0))
+                 for outfit_id in wanted if outfit_id in outfits),
+                Decimal('0'),
+            ),
+            lines=len(created) - len(removed),
+        )
+        return batch_lines(outfits, wanted), summary
+
+    def save(self, response):
+        return response
+
+
+class GuestLine:
+    """One line of a guest cart; mirrors what the cart templates read off a Cart row."""
+
+    def __init__(self, outfit, quantity):
+        # Guest lines have no row of their own, so the outfit id doubles as the line id
+        self.id = outfit.pk
+        self.outfit = outfit
+        self.quantity = quantity
+        self.line_total = outfit.price * quantity
+
+
+class GuestCart:
+    """
+    An anonymous shopper's cart, kept as {outfit_id: quantity} in a signed
+    cookie. Reads look the outfits up in one query; nothing is ever written.
+    Call save(response) to send the updated cookie back.
+    """
+
+    def __init__(self, request):
+        self.lines = self.load(request)
+        self.modified = False
+
+    @staticmethod
+    def load(request):
+        try:
+            raw = request.get_signed_cookie(GUEST_COOKIE, salt=GUEST_COOKIE_SALT, max_age=GUEST_COOKIE_AGE)
+            data = json.loads(raw)
+            return {int(outfit_id): int(quantity) for outfit_id, quantity in data.items() if int(quantity) > 0}
+        except (KeyError, signing.BadSignature, ValueError, TypeError, AttributeError):
+            return {}
+
+    def __bool__(self):
+        return bool(self.lines)
+
+    def items(self):
+        outfits = Outfit.objects.in_bulk(list(self.lines))
+        return [
+            GuestLine(outfits[outfit_id], quantity)
+            for outfit_id, quantity in self.lines.items()
+            if outfit_id in outfits
+        ]
+
+    def summary(self, items=None):
+        items = self.items() if items is None else items
+        total = sum((line.line_total for line in items), Decimal('0'))
+        return {
+            'lines': len(items),
+            'quantity': sum(line.quantity for line in items),
+            'total': total.quantize(Decimal('0.01')),
+        }
+
+    def add(self, outfit, quantity):
+        if outfit.pk not in self.lines and len(self.lines) >= GUEST_MAX_LINES:
+            raise ValidationError(f"A cart can hold at most {GUEST_MAX_LINES} different outfits.")
+        self.lines[outfit.pk] = self.lines.get(outfit.pk, 0) + quantity
+        self.modified = True
+        return self.summary()
+
+    def change(self, item_id, delta):
+        if item_id not in self.lines:
+            raise Cart.DoesNotExist
+        quantity = self.lines[item_id] + delta
+        if quantity < 1:
+            return None, self.remove(item_id)
+        items = self.items()
+        line = next((line for line in items if line.id == item_id), None)
+        if line is None:
+            raise Cart.DoesNotExist
+        if delta > 0:
+            check_stock(line.outfit, quantity)
+        self.lines[item_id] = quantity
+        self.modified = True
+        line.quantity, line.line_total = quantity, line.outfit.price * quantity
+        return line, self.summary(items)
+
+    def remove(self, item_id):
+        if self.lines.pop(item_id, None) is None:
+            raise Cart.DoesNotExist
+        self.modified = True
+        return self.summary()
+
+    def batch(self, operations):
+        wanted = apply_operations(
+            {outfit_id: self.lines.get(outfit_id, 0) for _, outfit_id, _ in operations},
+            operations,
+        )
+        outfits = Outfit.objects.in_bulk([outfit_id for outfit_id, quantity in wanted.items() if quantity])
+        check_batch(outfits, self.lines, wanted)
+        lines = dict(self.lines)
+        for outfit_id, quantity in wanted.items():
+            if quantity:
+                lines[outfit_id] = quantity
+            else:
+                lines.pop(outfit_id, None)
+        if len(lines) > GUEST_MAX_LINES:
+            raise ValidationError(f"A cart can hold at most {GUEST_MAX_LINES} different outfits.")
+        self.lines = lines
+        self.modified = True
+        return batch_lines(outfits, wanted), self.summary()
+
+    def clear(self):
+        self.modified = bool(self.lines)
+        self.lines = {}
+
+    def save(self, response):
+        if not self.modified:
+            return response
+        if self.lines:
+            response.set_signed_cookie(
+                GUEST_COOKIE,
+                json.dumps(self.lines, separators=(',', ':')),
+                salt=GUEST_COOKIE_SALT,
+                max_age=GUEST_COOKIE_AGE,
+                httponly=True,
+                samesite='Lax',
+            )
+        else:
+            response.delete_cookie(GUEST_COOKIE, samesite='Lax')
+        return response
+
+
+def get_cart(request):
+    if request.user.is_authenticated:
+        return UserCart(request.user)
+    return GuestCart(request)
+
+
+def merge_guest_cart(guest, user):
+    """
+    Fold a guest cart into the user's Cart rows: one read, one bulk_update
+    and one bulk_create however many lines the guest collected. The guest
+    cart is cleared; save() it on the response to drop the cookie.
+    """
+    if not guest:
+        return
+    wanted = {
+        outfit_id: guest.lines[outfit_id]
+        for outfit_id in Outfit.objects.filter(pk__in=list(guest.lines)).values_list('pk', flat=True)
+    }
+    with transaction.atomic():
+        existing = list(Cart.objects.filter(user=user, outfit_id__in=list(wanted)))
+        for item in existing:
+            item.quantity += wanted.pop(item.outfit_id)
+        Cart.objects.bulk_update(existing, ['quantity'])
+        Cart.objects.bulk_create([
+            Cart(user=user, outfit_id=outfit_id, quantity=quantity)
+            for outfit_id, quantity in wanted.items()
+        ])
+    invalidate(user)
+    guest.clear()
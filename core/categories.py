@@ -0,0 +1,51 @@
+"""
+Category navigation data shared by every page (see context_processors).
+
+Categories change rarely, so the list is cached twice: in the shared cache
+under a version number, and in a process-local copy tagged with the version
+it came from. Category save/delete bumps the version, which makes every
+process drop its local copy on its next request. In the steady state the
+nav costs one cache lookup and no database queries.
+"""
+import time
+
+from django.core.cache import cache
+
+from .models import Category
+
+VERSION_KEY = 'nav_categories:version'
+CACHE_TIMEOUT = 60 * 60 * 24
+
+_local = {'version': None, 'categories': None}
+
+
+def categories_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Start from the clock so a re-created key never repeats an old version
+        cache.add(VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # Key was evicted; reseed from the clock, past every version handed out before
+        categories_version()
+        cache.incr(VERSION_KEY)
+
+
+def nav_categories():
+    version = categories_version()
+    if _local['version'] == version:
+        return _local['categories']
+
+    key = f'nav_categories:{version}'
+    categories = cache.get(key)
+    if categories is None:
+        categories = list(Category.objects.all())
+        cache.set(key, categories, CACHE_TIMEOUT)
+    _local['version'], _local['categories'] = version, categories
+    return categories
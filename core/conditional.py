@@ -0,0 +1,96 @@
+"""
+ETag / Last-Modified validators for outfit and category pages.
+
+Each validator is built from a single values()/aggregate query, never the
+full object graph, and memoised on the request because Django's condition()
+asks for the ETag and Last-Modified separately.
+
+The rating summary and popularity counters are written with update() and do
+not move updated_at, so they are part of the ETag but not Last-Modified.
+Any outfit saved or deleted moves its categories' updated_at (see signals),
+so a category's Last-Modified never goes back when its newest outfit is
+deactivated or deleted.
+Pages also differ per user (nav, cart, CSRF token), so the ETag includes
+the user, a hash of the CSRF cookie (rotated on login and logout, and baked
+into every form on the page) and the category nav version; Last-Modified is
+only sent to anonymous visitors.
+"""
+import hashlib
+
+from django.conf import settings
+from django.db.models import Count, Max, Q, Sum
+
+from .categories import categories_version
+from .models import Category, Outfit
+
+
+def _memoise(func):
+    attr = f'_conditional_{func.__name__}'
+
+    def wrapper(request, **kwargs):
+        if not hasattr(request, attr):
+            setattr(request, attr, func(request, **kwargs))
+        return getattr(request, attr)
+    return wrapper
+
+
+def _etag(request, state):
+    # Flash messages are one-off content; never let them be answered with a 304
+    if state is None or 'messages' in request.COOKIES:
+        return None
+    user = request.user.pk if request.user.is_authenticated else 'anon'
+    csrf = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+    return hashlib.md5(repr((user, csrf, categories_version(), state)).encode()).hexdigest()
+
+
+def _last_modified(request, value):
+    if request.user.is_authenticated or 'messages' in request.COOKIES:
+        return None
+    return value
+
+
+@_memoise
+def outfit_state(request, pk, **kwargs):
+    return (
+        Outfit.objects.filter(pk=pk)
+        .values_list('updated_at', 'rating_count', 'rating_sum')
+        .first()
+    )
+
+
+def outfit_etag(request, **kwargs):
+    return _etag(request, outfit_state(request, **kwargs))
+
+
+def outfit_last_modified(request, **kwargs):
+    state = outfit_state(request, **kwargs)
+    return _last_modified(request, state[0]) if state else None
+
+
+@_memoise
+def category_state(request, slug, **kwargs):
+    # Sort and filter params are part of the URL, so they don't need to be in the ETag
+    active = Q(outfit__is_active=True)
+    return (
+        Category.objects.filter(slug=slug)
+        .annotate(
+            newest=Max('outfit__updated_at', filter=active),
+            active_count=Count('outfit', filter=active),
+            ratings=Sum('outfit__rating_count', filter=active),
+            orders=Sum('outfit__order_count', filter=active),
+        )
+        .values_list('updated_at', 'newest', 'active_count', 'ratings', 'orders')
+        .first()
+    )
+
+
+def category_etag(request, **kwargs):
+    return _etag(request, category_state(request, **kwargs))
+
+
+def category_last_modified(request, **kwargs):
+    state = category_state(request, **kwargs)
+    if state is None:
+        return None
+    updated_at, newest = state[0], state[1]
+    return _last_modified(request, max(filter(None, (updated_at, newest))))
@@ -1,6 +1,19 @@
-from .models import Category
+from django.utils.functional import SimpleLazyObject
+
+from .categories import nav_categories
+from .page_cache import CSRF_PLACEHOLDER
+
 
 def categories_processor(request):
+    # Lazy: pages that never render the category nav don't touch the cache at all
     return {
-        'categories': Category.objects.all()
+        'categories': SimpleLazyObject(nav_categories)
     }
+
+
+def page_cache_csrf(request):
+    # Pages stored by the anonymous page cache get a placeholder token,
+    # replaced with the visitor's real token whenever the page is served
+    if getattr(request, 'page_cache_active', False):
+        return {'csrf_token': CSRF_PLACEHOLDER}
+    return {}
@@ -0,0 +1,185 @@
+"""
+Moving the media library over to content-addressed names.
+
+Uploads from before core.storage have names like hero1_0yFy2ss.jpg, often
+several copies of the same bytes. dedupe() stores each referenced file once
+in the hash-named pool, then rewrites every reference in one transaction:
+the IMAGE_FIELDS columns and the derivative rows (so nothing is
+regenerated) with a CASE UPDATE per batch of names, order receipts with
+bulk_update, and placeholders are remade for the new names. Only once that
+has committed are the old files deleted, along with unreferenced copies
+left in the upload folders by earlier re-uploads; an interrupted run
+leaves at worst some extra copies behind.
+"""
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Case, CharField, Q, Value, When
+from django.utils import timezone
+
+from . import images, jobs, page_cache, placeholders
+from .models import Category, ImageDerivative, ImagePlaceholder, MediaJob, Order, Outfit
+from .storage import content_hash, hashed_name, is_hashed
+
+
+class DedupeResult:
+    def __init__(self):
+        self.files = 0
+        self.stored = 0  # distinct files after the move
+        self.copies = 0  # unreferenced duplicates in the upload folders
+        self.missing = []
+        self.rows = 0
+        self.receipts = 0
+        self.freed = 0  # bytes taken by the copies that go away
+
+
+def receipt_images():
+    names = set()
+    for receipt in Order.objects.filter(receipt__has_key='lines').values_list('receipt', flat=True).iterator():
+        names.update(line['image'] for line in receipt['lines'] if line.get('image'))
+    return names
+
+
+def upload_dirs():
+    return sorted({model._meta.get_field(field).upload_to.strip('/') for model, field in images.IMAGE_FIELDS})
+
+
+def stray_files(referenced, storage):
+    """Files in the upload folders that nothing points at."""
+    for directory in upload_dirs():
+        if not storage.exists(directory):
+            continue
+        for filename in storage.listdir(directory)[1]:
+            name = f'{directory}/{filename}'
+            if name not in referenced:
+                yield name
+
+
+def plan(names, storage=default_storage):
+    """Hash every file: returns ({old: new}, missing names, sizes by old name)."""
+    mapping, missing, sizes = {}, [], {}
+    for name in names:
+        if not storage.exists(name):
+            missing.append(name)
+            continue
+        with storage.open(name, 'rb') as handle:
+            mapping[name] = hashed_name(name, content_hash(handle))
+        sizes[name] = storage.size(name)
+    return mapping, missing, sizes
+
+
+def case_for(field, pairs):
+    return Case(
+        *(When(**{field: old}, then=Value(new)) for old, new in pairs),
+        output_field=CharField(),
+    )
+
+
+def rewrite(model, field, mapping, batch_size):
+    rows = 0
+    pairs = list(mapping.items())
+    for start in range(0, len(pairs), batch_size):
+        batch = pairs[start:start + batch_size]
+        rows += model.objects.filter(**{f'{field}__in': [old for old, _ in batch]}).update(
+            **{field: case_for(field, batch)},
+        )
+    return rows
+
+
+def rewrite_derivatives(mapping, batch_size, storage):
+    """
+    Hand each new name the derivatives of one of its old names. Old names
+    that now share a file have identical derivatives, so the rest are deleted.
+    Returns the new names that have none and need a job.
+    """
+    targets = set(mapping.values())
+    have = set(
+        ImageDerivative.objects.filter(source__in=[*mapping, *targets])
+        .values_list('source', flat=True).distinct()
+    )
+    keep, drop = {}, []
+    for old, new in mapping.items():
+        if old not in have:
+            continue
+        if new in have or new in keep.values():
+            drop.append(old)
+        else:
+            keep[old] = new
+    if drop:
+        paths = list(ImageDerivative.objects.filter(source__in=drop).values_list('path', flat=True))
+        ImageDerivative.objects.filter(source__in=drop).delete()
+        transaction.on_commit(lambda: images.delete_unused(paths, storage))
+    rewrite(ImageDerivative, 'source', keep, batch_size)
+    return targets - have - set(keep.values())
+
+
+def rewrite_receipts(mapping, batch_size):
+    changed = []
+    for order in Order.objects.filter(receipt__has_key='lines').only('pk', 'receipt').iterator(chunk_size=batch_size):
+        touched = False
+        for line in order.receipt['lines']:
+            if line.get('image') in mapping:
+                line['image'] = mapping[line['image']]
+                touched = True
+        if touched:
+            changed.append(order)
+    Order.objects.bulk_update(changed, ['receipt'], batch_size=batch_size)
+    return len(changed)
+
+
+def dedupe(dry_run=False, keep_originals=False, batch_size=500, storage=default_storage):
+    result = DedupeResult()
+    referenced = set(images.all_sources()) | receipt_images()
+    mapping, result.missing, sizes = plan(sorted(name for name in referenced if not is_hashed(name)), storage)
+    strays, _, stray_sizes = plan(stray_files(referenced, storage), storage)
+    pooled = set(mapping.values()) | {name for name in referenced if is_hashed(name)}
+    # a stray is only a redundant copy if its bytes are kept under a hash name
+    strays = {name: new for name, new in strays.items() if new in pooled}
+
+    result.files = len(mapping)
+    result.stored = len(set(mapping.values()))
+    result.copies = len(strays)
+    seen = set()
+    for old, new in mapping.items():
+        if new in seen or storage.exists(new):
+            result.freed += sizes[old]
+        seen.add(new)
+    result.freed += sum(stray_sizes[name] for name in strays)
+    if dry_run or not (mapping or strays):
+        return result
+
+    for old, new in mapping.items():
+        if not storage.exists(new):
+            with storage.open(old, 'rb') as handle:
+                storage.save(old, handle)
+
+    old_names = list(mapping)
+    with transaction.atomic():
+        outfits = list(
+            Outfit.objects.filter(Q(image__in=old_names) | Q(images__image__in=old_names))
+            .values_list('pk', 'category_id').distinct()
+        )
+        category_ids = list(Category.objects.filter(image__in=old_names).values_list('pk', flat=True))
+        for model, field in images.IMAGE_FIELDS:
+            result.rows += rewrite(model, field, mapping, batch_size)
+        # cached cards are keyed on updated_at
+        now = timezone.now()
+        Outfit.objects.filter(pk__in=[pk for pk, _ in outfits]).update(updated_at=now)
+        Category.objects.filter(pk__in=category_ids).update(updated_at=now)
+
+        # jobs for the old names are replaced by one per new name still without derivatives
+        MediaJob.objects.filter(source__in=old_names, status__in=('queued', 'running')).delete()
+        for name in rewrite_derivatives(mapping, batch_size, storage):
+            jobs.enqueue('derivatives', name)
+        result.receipts = rewrite_receipts(mapping, batch_size)
+        # placeholders are tiny; remaking them is simpler than merging rows
+        ImagePlaceholder.objects.filter(source__in=old_names).delete()
+        placeholders.generate(sorted(set(mapping.values())), storage)
+
+        if not keep_originals:
+            for name in [*old_names, *strays]:
+                transaction.on_commit(lambda name=name: storage.delete(name))
+
+    for pk, category_id in outfits:
+        page_cache.purge_outfit(pk, category_id)
+    page_cache.purge('category_list', *(f'category:{pk}' for pk in category_ids))
+    return result
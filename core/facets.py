@@ -0,0 +1,140 @@
+"""
+Faceted filtering for category pages.
+
+Facet counts for a category come from a single grouped query over every
+combination of facet values, cached until an outfit in that category changes.
+Counts for the current selection are then derived in Python from the cached
+rows, so a filtered page never runs a GROUP BY of its own.
+"""
+from collections import Counter
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Case, CharField, Count, Q, Value, When
+
+from .models import Outfit
+
+FACET_FIELDS = ('brand', 'color', 'size', 'material')
+
+# (key, label, min price inclusive, max price exclusive)
+PRICE_RANGES = (
+    ('under-1000', 'Under Ksh 1,000', None, Decimal('1000')),
+    ('1000-2500', 'Ksh 1,000 - 2,500', Decimal('1000'), Decimal('2500')),
+    ('2500-5000', 'Ksh 2,500 - 5,000', Decimal('2500'), Decimal('5000')),
+    ('5000-10000', 'Ksh 5,000 - 10,000', Decimal('5000'), Decimal('10000')),
+    ('over-10000', 'Over Ksh 10,000', Decimal('10000'), None),
+)
+PRICE_LABELS = {key: label for key, label, _, _ in PRICE_RANGES}
+
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def cache_key(category_id):
+    return f'category_facets:{category_id}'
+
+
+def invalidate(category_id):
+    if category_id:
+        cache.delete(cache_key(category_id))
+
+
+def price_range_q(key):
+    for range_key, _, low, high in PRICE_RANGES:
+        if range_key == key:
+            q = Q()
+            if low is not None:
+                q &= Q(price__gte=low)
+            if high is not None:
+                q &= Q(price__lt=high)
+            return q
+    return None
+
+
+def price_bucket():
+    whens = []
+    for key, _, low, high in PRICE_RANGES:
+        condition = Q()
+        if low is not None:
+            condition &= Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        whens.append(When(condition, then=Value(key)))
+    return Case(*whens, output_field=CharField())
+
+
+def facet_rows(category_id):
+    """
+    [(brand, color, size, material, price_key, count), ...] for the active outfits of a category.
+    One GROUP BY query on a cache miss, nothing afterwards.
+    """
+    key = cache_key(category_id)
+    rows = cache.get(key)
+    if rows is None:
+        rows = list(
+            Outfit.objects.filter(category_id=category_id, is_active=True)
+            .annotate(price_key=price_bucket())
+            .values_list(*FACET_FIELDS, 'price_key')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+        cache.set(key, rows, CACHE_TIMEOUT)
+    return rows
+
+
+def selected_filters(params):
+    """Read the facet selection from request.GET, ignoring unknown price ranges."""
+    selected = {field: [v for v in params.getlist(field) if v] for field in FACET_FIELDS}
+    selected['price'] = [v for v in params.getlist('price') if v in PRICE_LABELS]
+    return selected
+
+
+def apply_filters(queryset, selected):
+    for field in FACET_FIELDS:
+        if selected[field]:
+            queryset = queryset.filter(**{f'{field}__in': selected[field]})
+    if selected['price']:
+        q = Q()
+        for key in selected['price']:
+            q |= price_range_q(key)
+        queryset = queryset.filter(q)
+    return queryset
+
+
+def build_facets(category_id, selected):
+    """
+    Facet values with counts for the current selection.
+    Each facet is counted with every *other* facet's filter applied, so the
+    counts show how many results ticking that value would add.
+    """
+    rows = facet_rows(category_id)
+    names = FACET_FIELDS + ('price',)
+    counters = {name: Counter() for name in names}
+
+    for *values, count in rows:
+        row = dict(zip(names, values))
+        failing = [name for name in names if selected[name] and row[name] not in selected[name]]
+        if len(failing) > 1:
+            continue
+        for name in names:
+            if row[name] in (None, ''):
+                continue
+            if not failing or failing == [name]:
+                counters[name][row[name]] += count
+
+    facets = []
+    for field in FACET_FIELDS:
+        values = [
+            {'value': value, 'label': value, 'count': count, 'selected': value in selected[field]}
+            for value, count in sorted(counters[field].items())
+        ]
+        if values:
+            facets.append({'name': field, 'label': field.title(), 'values': values})
+
+    prices = [
+        {'value': key, 'label': label, 'count': counters['price'][key], 'selected': key in selected['price']}
+        for key, label, _, _ in PRICE_RANGES
+        if counters['price'][key]
+    ]
+    if prices:
+        facets.append({'name': 'price', 'label': 'Price', 'values': prices})
+    return facets
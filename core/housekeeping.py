@@ -0,0 +1,113 @@
+"""
+Sweeping stale per-user rows.
+
+Cart, Compare and Wishlist rows are only ever added, so abandoned ones pile
+up. sweep() deletes the rows older than a cutoff (by added_at) in bounded
+batches, each in its own short transaction, so SQLite's write lock is only
+held for one batch at a time and the site keeps serving in between.
+
+Space is reported from SQLite itself: deleted rows' pages go to the
+freelist (VACUUM gives them back to the OS), so the freelist growth is
+what a sweep reclaimed. A dry run estimates it from the dbstat table sizes.
+"""
+import json
+import time
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+
+from . import cart
+from .models import Cart, Compare, Wishlist
+
+SWEEPABLE = {
+    'cart': Cart,
+    'compare': Compare,
+    'wishlist': Wishlist,
+}
+
+
+class SweepResult:
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.batches = 0
+        self.bytes = None
+
+
+def sqlite_pragma(name):
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA {name}')
+        return cursor.fetchone()[0]
+
+
+def free_bytes():
+    """Bytes on SQLite's freelist, or None on other databases."""
+    if connection.vendor != 'sqlite':
+        return None
+    return sqlite_pragma('freelist_count') * sqlite_pragma('page_size')
+
+
+def table_bytes(model):
+    """Bytes used by a table and its indexes, if SQLite was built with dbstat."""
+    if connection.vendor != 'sqlite':
+        return None
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT SUM(pgsize) FROM dbstat WHERE name = %s "
+                "OR name IN (SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s)",
+                [table, table],
+            )
+            return cursor.fetchone()[0] or 0
+    except Exception:
+        return None
+
+
+def archive_rows(model, pks, archive):
+    for row in model.objects.filter(pk__in=pks).values():
+        archive.write(json.dumps({'model': model._meta.label, **row}, cls=DjangoJSONEncoder) + '\n')
+
+
+def sweep(name, cutoff, batch_size=1000, dry_run=False, pause=0.0, archive=None):
+    """
+    Delete (or, with dry_run, count) the model's rows added before cutoff.
+    archive: an open text file; rows are written to it as JSON lines first.
+    """
+    model = SWEEPABLE[name]
+    result = SweepResult(name)
+    stale = model.objects.filter(added_at__lt=cutoff)
+
+    if dry_run:
+        result.rows = stale.count()
+        total = model.objects.count()
+        size = table_bytes(model)
+        if size is not None and total:
+            result.bytes = size * result.rows // total
+        return result
+
+    before = free_bytes()
+    while True:
+        with transaction.atomic():
+            batch = list(stale.order_by('pk').values_list('pk', 'user_id')[:batch_size])
+            if not batch:
+                break
+            pks = [pk for pk, _ in batch]
+            if archive is not None:
+                archive_rows(model, pks, archive)
+            model.objects.filter(pk__in=pks).delete()
+        if model is Cart:
+            # cached cart totals would still count the swept lines
+            cache.delete_many([key for user_id in {user_id for _, user_id in batch} for key in cart.summary_keys(user_id)])
+        result.rows += len(pks)
+        result.batches += 1
+        if len(batch) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)  # let other writers in between batches
+
+    after = free_bytes()
+    if before is not None and after is not None:
+        result.bytes = max(after - before, 0)
+    return result
@@ -0,0 +1,169 @@
+"""
+Responsive image derivatives.
+
+Every uploaded image (IMAGE_FIELDS) gets resized copies at the WIDTHS
+presets, each as WebP and as JPEG for browsers without WebP, stored under
+derivatives/ and recorded in ImageDerivative. The {% responsive_image %}
+tag turns them into a <picture> with srcset, so a listing card downloads
+a 320px WebP instead of the full-size phone photo.
+
+Derivatives are made in the background for every newly saved image (see
+signals and core.jobs) and for the existing library by the
+generate_image_derivatives command. Sources are never upscaled; a source
+narrower than a preset gets one copy at its own width instead.
+"""
+import hashlib
+import io
+import logging
+import posixpath
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from . import page_cache
+from .models import Category, ImageDerivative, Outfit, OutfitImage, Profile
+
+logger = logging.getLogger(__name__)
+
+WIDTHS = (320, 640, 1024)
+FORMATS = {
+    'webp': {'format': 'WEBP', 'ext': 'webp', 'options': {'quality': 80, 'method': 4}},
+    'jpeg': {'format': 'JPEG', 'ext': 'jpg', 'options': {'quality': 82, 'optimize': True, 'progressive': True}},
+}
+IMAGE_FIELDS = (
+    (Outfit, 'image'),
+    (OutfitImage, 'image'),
+    (Category, 'image'),
+    (Profile, 'profile_image'),
+)
+CACHE_TIMEOUT = 60 * 60 * 24
+# "none yet" is only cached briefly: the worker that makes them may not share our cache
+PENDING_CACHE_TIMEOUT = 60
+
+
+def cache_key(source):
+    return 'image_derivatives:' + hashlib.md5(source.encode()).hexdigest()
+
+
+def derivative_dir(source):
+    stem = posixpath.splitext(posixpath.basename(source))[0]
+    # the hash keeps same-named uploads in different folders apart
+    return f"derivatives/{hashlib.md5(source.encode()).hexdigest()[:8]}-{stem}"
+
+
+def target_widths(original_width):
+    widths = [width for width in WIDTHS if width < original_width]
+    # one copy at the source's own width: recompressed, but never upscaled
+    widths.append(min(original_width, WIDTHS[-1]))
+    return widths
+
+
+def generate(source, storage=default_storage, force=False):
+    """
+    Create the derivatives for one stored image and return their rows.
+    Existing derivatives are kept unless force is set.
+    """
+    if not force:
+        existing = list(ImageDerivative.objects.filter(source=source))
+        if existing:
+            return existing
+    previous = set(ImageDerivative.objects.filter(source=source).values_list('path', flat=True))
+
+    try:
+        with storage.open(source, 'rb') as handle:
+            original = Image.open(handle)
+            original.load()
+    except (OSError, UnidentifiedImageError) as e:
+        logger.warning("Can't make derivatives of %s: %s", source, e)
+        return []
+
+    original = ImageOps.exif_transpose(original)  # phone photos carry their rotation in EXIF
+    if original.mode not in ('RGB', 'L'):
+        original = original.convert('RGB')
+
+    rows = []
+    directory = derivative_dir(source)
+    for width in target_widths(original.width):
+        height = max(round(original.height * width / original.width), 1)
+        resized = original if width == original.width else original.resize((width, height), Image.LANCZOS)
+        for name, spec in FORMATS.items():
+            buffer = io.BytesIO()
+            resized.save(buffer, spec['format'], **spec['options'])
+            path = f"{directory}/{width}.{spec['ext']}"
+            if storage.exists(path):
+                storage.delete(path)
+            path = storage.save(path, ContentFile(buffer.getvalue()))
+            rows.append(ImageDerivative(
+                source=source, width=width, format=name, path=path,
+                actual_width=width, actual_height=height, bytes=buffer.tell(),
+            ))
+
+    ImageDerivative.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['source', 'width', 'format'],
+        update_fields=['path', 'actual_width', 'actual_height', 'bytes'],
+    )
+    cache.delete(cache_key(source))
+    # content-addressed storage gives changed derivatives new names; drop the old files
+    delete_unused(previous - {row.path for row in rows}, storage)
+    return rows
+
+
+def delete_unused(paths, storage=default_storage):
+    """Delete derivative files no row points at any more (pooled files can be shared)."""
+    paths = set(paths)
+    if paths:
+        paths -= set(ImageDerivative.objects.filter(path__in=paths).values_list('path', flat=True))
+    for path in paths:
+        storage.delete(path)
+
+
+def derivatives(source):
+    """{'webp': [(url, width), ...], 'jpeg': [...]} for a stored image, smallest first."""
+    key = cache_key(source)
+    found = cache.get(key)
+    if found is None:
+        found = {name: [] for name in FORMATS}
+        rows = ImageDerivative.objects.filter(source=source).order_by('width').values_list('format', 'path', 'actual_width')
+        for name, path, width in rows:
+            found.setdefault(name, []).append((default_storage.url(path), width))
+        cache.set(key, found, CACHE_TIMEOUT if any(found.values()) else PENDING_CACHE_TIMEOUT)
+    return found
+
+
+def all_sources():
+    """Every image name referenced by an IMAGE_FIELDS column, without duplicates."""
+    seen = set()
+    for model, field in IMAGE_FIELDS:
+        names = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True}).values_list(field, flat=True)
+        for name in names.distinct().iterator():
+            if name not in seen:
+                seen.add(name)
+                yield name
+
+
+def derivatives_ready(source):
+    refresh_pages([source])
+
+
+def refresh_pages(sources):
+    """
+    Make pages pick up new derivatives or placeholders of these sources:
+    cached cards are keyed on updated_at and cached pages carry outfit/category tags.
+    """
+    now = timezone.now()
+    outfits = Outfit.objects.filter(Q(image__in=sources) | Q(images__image__in=sources)).distinct()
+    rows = list(outfits.values_list('pk', 'category_id'))
+    if rows:
+        Outfit.objects.filter(pk__in=[pk for pk, _ in rows]).update(updated_at=now)
+        for pk, category_id in rows:
+            page_cache.purge_outfit(pk, category_id)
+    category_ids = list(Category.objects.filter(image__in=sources).values_list('pk', flat=True))
+    if category_ids:
+        Category.objects.filter(pk__in=category_ids).update(updated_at=now)
+        page_cache.purge('category_list', *(f'category:{pk}' for pk in category_ids))
@@ -0,0 +1,161 @@
+"""
+Inventory and cart reservations.
+
+Outfit.stock is the number of units on hand (None: not tracked) and
+Outfit.reserved the units currently held by shoppers' StockReservations.
+Every change to either goes through a conditional UPDATE ... WHERE with F()
+expressions, so the database, not Python, decides whether enough units are
+left and two concurrent checkouts can never both take the last unit.
+
+A signed-in shopper's cart is reserved when they open it (reserve_cart), for
+RESERVATION_MINUTES. Checkout turns the shopper's holds into sales
+(take_stock); holds that run out are given back by release_expired(), run
+from the release_reservations command.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Outfit, StockReservation
+
+RESERVATION_MINUTES = 15
+
+
+class OutOfStock(Exception):
+    def __init__(self, outfits):
+        self.outfits = outfits
+        names = ', '.join(outfit.name for outfit in outfits)
+        super().__init__(f"Not enough stock left for: {names}")
+
+
+def hold(outfit_id, quantity):
+    """Reserve quantity more units if they are free; returns whether it worked."""
+    return bool(
+        Outfit.objects.filter(pk=outfit_id, stock__isnull=False, stock__gte=F('reserved') + quantity)
+        .update(reserved=F('reserved') + quantity)
+    )
+
+
+def release(outfit_id, quantity):
+    # Greatest() keeps a drifted counter from going negative
+    Outfit.objects.filter(pk=outfit_id).update(reserved=Greatest(F('reserved') - quantity, 0))
+
+
+def reserve_cart(user, items):
+    """
+    Bring the user's reservations in line with their cart items and push
+    their expiry out. Returns the outfits that couldn't be held in full.
+    """
+    wanted = {}
+    for item in items:
+        if item.outfit.stock is not None:
+            wanted[item.outfit_id] = wanted.get(item.outfit_id, 0) + item.quantity
+
+    short = []
+    expires_at = timezone.now() + timedelta(minutes=RESERVATION_MINUTES)
+    with transaction.atomic():
+        held = {r.outfit_id: r for r in StockReservation.objects.select_for_update().filter(user=user)}
+        changed, created, dropped = [], [], []
+        for outfit_id, reservation in held.items():
+            if outfit_id not in wanted:
+                release(outfit_id, reservation.quantity)
+                dropped.append(reservation.pk)
+        for item in items:
+            outfit_id = item.outfit_id
+            if outfit_id not in wanted:
+                continue
+            quantity = wanted.pop(outfit_id)
+            reservation = held.get(outfit_id)
+            current = reservation.quantity if reservation else 0
+            if quantity > current and not hold(outfit_id, quantity - current):
+                short.append(item.outfit)
+                quantity = current
+            elif quantity < current:
+                release(outfit_id, current - quantity)
+
+            if reservation is None:
+                if quantity:
+                    created.append(StockReservation(user=user, outfit_id=outfit_id, quantity=quantity, expires_at=expires_at))
+            elif quantity:
+                reservation.quantity, reservation.expires_at = quantity, expires_at
+                changed.append(reservation)
+            else:
+                dropped.append(reservation.pk)
+        if changed:
+            StockReservation.objects.bulk_update(changed, ['quantity', 'expires_at'])
+        if created:
+            StockReservation.objects.bulk_create(created)
+        if dropped:
+            StockReservation.objects.filter(pk__in=dropped).delete()
+    return short
+
+
+def take_stock(user, items):
+    """
+    Decrement stock for the cart items being checked out (outfits loaded).
+    Units the user has reserved are consumed first; the rest must be free.
+    Runs inside the checkout transaction: raises OutOfStock, which rolls it
+    back. Carts with no stock-tracked outfits cost no queries at all.
+    """
+    lines = {}
+    for item in items:
+        if item.outfit.stock is not None:
+            lines[item.outfit_id] = lines.get(item.outfit_id, 0) + item.quantity
+    if not lines:
+        return
+
+    held = {
+        r.outfit_id: r.quantity
+        for r in StockReservation.objects.select_for_update().filter(user=user, outfit_id__in=list(lines))
+    }
+    short = []
+    for outfit_id, quantity in lines.items():
+        own = min(held.get(outfit_id, 0), quantity)
+        taken = Outfit.objects.filter(
+            pk=outfit_id,
+            stock__isnull=False,
+            reserved__gte=own,
+            stock__gte=F('reserved') - own + quantity,
+        ).update(stock=F('stock') - quantity, reserved=F('reserved') - own)
+        if not taken:
+            short.append(outfit_id)
+        elif held.get(outfit_id, 0) > own:
+            release(outfit_id, held[outfit_id] - own)
+    if short:
+        raise OutOfStock(list(Outfit.objects.filter(pk__in=short).order_by('name')))
+    if held:
+        StockReservation.objects.filter(user=user, outfit_id__in=list(held)).delete()
+
+
+def restock(lines):
+    """Put units back on the shelf, e.g. for a cancelled order; {outfit_id: quantity}."""
+    for outfit_id, quantity in lines.items():
+        Outfit.objects.filter(pk=outfit_id, stock__isnull=False).update(stock=F('stock') + quantity)
+
+
+def release_expired(now=None, batch_size=500):
+    """Give back the units held by expired reservations; returns how many reservations were dropped."""
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            expired = list(
+                StockReservation.objects.select_for_update()
+                .filter(expires_at__lte=now)
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not expired:
+                return released
+            totals = (
+                StockReservation.objects.filter(pk__in=expired)
+                .values('outfit')
+                .annotate(units=Sum('quantity'))
+                .order_by()
+            )
+            for row in totals:
+                release(row['outfit'], row['units'])
+            StockReservation.objects.filter(pk__in=expired).delete()
+        released += len(expired)
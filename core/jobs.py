@@ -0,0 +1,134 @@
+"""
+Background media jobs.
+
+Saving an upload only records a queued MediaJob (enqueue()); the request
+returns straight away and the run_media_workers command does the slow part
+in a pool of worker processes. Until a job is done pages simply show the
+original image, which {% responsive_image %} falls back to.
+
+Workers claim() due jobs with a conditional UPDATE, so several workers (or
+several machines sharing the database) never run the same job twice. A job
+that raises is put back with a growing delay and marked failed after
+MAX_ATTEMPTS; one whose worker died mid-run is requeued by requeue_stale().
+"""
+import logging
+import os
+import socket
+import traceback
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import images, placeholders
+from .models import MediaJob
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF = 30  # seconds, doubled after every failed run
+STALE_RUNNING = timedelta(minutes=10)
+
+
+class JobError(Exception):
+    pass
+
+
+def make_derivatives(source):
+    if not images.generate(source):
+        # an unreadable upload may still be mid-copy on shared storage; retry
+        raise JobError(f"Couldn't read {source}")
+    placeholders.generate([source])
+    images.derivatives_ready(source)
+
+
+HANDLERS = {
+    'derivatives': make_derivatives,
+}
+
+
+def enqueue(kind, source, delay=None):
+    """
+    Queue a job unless the same one is already waiting or running.
+    Returns True when a new job was queued.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown media job {kind!r}")
+    run_after = timezone.now() + (delay or timedelta())
+    try:
+        # savepoint, so a duplicate doesn't break the caller's transaction
+        with transaction.atomic():
+            MediaJob.objects.create(kind=kind, source=source, run_after=run_after)
+    except IntegrityError:
+        return False
+    return True
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim(limit, worker=None, now=None):
+    """Mark up to limit due jobs as running for this worker and return their ids."""
+    now = now or timezone.now()
+    worker = worker or worker_name()
+    due = list(
+        MediaJob.objects.filter(status='queued', run_after__lte=now)
+        .order_by('run_after', 'pk')
+        .values_list('pk', flat=True)[:limit]
+    )
+    if not due:
+        return []
+    # Re-check the status in the UPDATE so a job another worker got first is left out
+    MediaJob.objects.filter(pk__in=due, status='queued').update(
+        status='running', worker=worker, locked_at=now,
+        attempts=F('attempts') + 1, updated_at=now,
+    )
+    return list(
+        MediaJob.objects.filter(pk__in=due, status='running', worker=worker, locked_at=now)
+        .values_list('pk', flat=True)
+    )
+
+
+def execute(job_id):
+    """Run one claimed job and record how it went. Returns the job's new status."""
+    job = MediaJob.objects.get(pk=job_id)
+    if job.status != 'running':
+        return job.status
+    try:
+        HANDLERS[job.kind](job.source)
+    except Exception as e:
+        logger.warning("Media job %s (%s %s) failed: %s", job.pk, job.kind, job.source, e)
+        error = ''.join(traceback.format_exception_only(type(e), e)).strip()
+        if job.attempts >= MAX_ATTEMPTS:
+            status, run_after = 'failed', job.run_after
+        else:
+            status = 'queued'
+            run_after = timezone.now() + timedelta(seconds=RETRY_BACKOFF * 2 ** (job.attempts - 1))
+        MediaJob.objects.filter(pk=job.pk, status='running').update(
+            status=status, run_after=run_after, last_error=error[:1000],
+            locked_at=None, updated_at=timezone.now(),
+        )
+        return status
+
+    MediaJob.objects.filter(pk=job.pk, status='running').update(
+        status='done', last_error='', locked_at=None, updated_at=timezone.now(),
+    )
+    return 'done'
+
+
+def release(worker):
+    """Put back the jobs a worker claimed, when it is stopped before running them."""
+    return MediaJob.objects.filter(status='running', worker=worker).update(
+        status='queued', attempts=F('attempts') - 1, locked_at=None, updated_at=timezone.now(),
+    )
+
+
+def requeue_stale(now=None):
+    """Put back jobs whose worker stopped before finishing them; returns how many."""
+    now = now or timezone.now()
+    return MediaJob.objects.filter(status='running', locked_at__lt=now - STALE_RUNNING).update(
+        status='queued', run_after=now, locked_at=None, updated_at=now,
+    )
+
@@ -0,0 +1,98 @@
+"""
+Order lifecycle.
+
+TRANSITIONS lists which statuses an order may move to from each status.
+transition() applies one move to a whole queryset of orders: the orders
+that may make it are read once, moved with one UPDATE per
+UPDATE_BATCH_SIZE orders guarded by the same status filter, and their
+customers are notified with chunked bulk_create. Cancelling also puts the cancelled orders' units back on the
+shelf. Orders whose current status doesn't allow the move are left alone
+and counted as skipped.
+"""
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from . import inventory
+from .models import Notification, Order
+
+TRANSITIONS = {
+    'pending': ('processing', 'cancelled'),
+    'processing': ('completed', 'cancelled'),
+    'completed': (),
+    'cancelled': (),
+}
+
+NOTIFICATIONS = {
+    'processing': "Payment received: your order #{pk} is being processed.",
+    'completed': "Your order #{pk} has been completed.",
+    'cancelled': "Your order #{pk} has been cancelled.",
+}
+
+NOTIFICATION_BATCH_SIZE = 500
+# ids per UPDATE; keeps each statement under SQLite's bound-parameter limit
+UPDATE_BATCH_SIZE = 5000
+
+
+def sources_for(target):
+    """The statuses an order may be in to move to target."""
+    if target not in TRANSITIONS:
+        raise ValidationError(f"Unknown order status {target!r}.")
+    return [status for status, targets in TRANSITIONS.items() if target in targets]
+
+
+def can_transition(current, target):
+    return target in TRANSITIONS.get(current, ())
+
+
+def transition(orders, target, notify=True):
+    """
+    Move every order in the queryset that is allowed to reach target.
+    Returns (moved, skipped).
+    """
+    sources = sources_for(target)
+    with transaction.atomic():
+        eligible = orders.filter(status__in=sources)
+        fields = ['pk', 'customer_id'] + (['receipt'] if target == 'cancelled' else [])
+        rows = list(eligible.select_for_update().values_list(*fields))
+        skipped = orders.exclude(status__in=sources).count()
+        if not rows:
+            return 0, skipped
+
+        moved_ids = [row[0] for row in rows]
+        for start in range(0, len(moved_ids), UPDATE_BATCH_SIZE):
+            # Re-check the status in the UPDATE itself so a concurrent change can't be overwritten
+            Order.objects.filter(
+                pk__in=moved_ids[start:start + UPDATE_BATCH_SIZE], status__in=sources,
+            ).update(status=target)
+
+        if target == 'cancelled':
+            lines = {}
+            for _, _, receipt in rows:
+                for line in (receipt or {}).get('lines', []):
+                    if line['outfit_id']:
+                        lines[line['outfit_id']] = lines.get(line['outfit_id'], 0) + line['quantity']
+            inventory.restock(lines)
+
+        if notify:
+            message = NOTIFICATIONS[target]
+            Notification.objects.bulk_create(
+                [
+                    Notification(user_id=row[1], message=message.format(pk=row[0]))
+                    for row in rows if row[1] is not None
+                ],
+                batch_size=NOTIFICATION_BATCH_SIZE,
+            )
+    return len(rows), skipped
+
+
+def transition_order(order, target, notify=True):
+    """Move a single order, raising ValidationError if its status doesn't allow it."""
+    if not can_transition(order.status, target):
+        raise ValidationError(
+            f"Order #{order.pk} can't go from {order.get_status_display()} "
+            f"to {dict(Order.STATUS_CHOICES).get(target, target)}."
+        )
+    moved, _ = transition(Order.objects.filter(pk=order.pk), target, notify=notify)
+    if not moved:
+        raise ValidationError(f"Order #{order.pk} changed status in the meantime.")
+    order.status = target
@@ -0,0 +1,57 @@
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from core.models import Cart, Outfit, Profile
+from core.orders import place_order
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Time checkout for carts of different sizes (every run is rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,5,20,50', help="Comma separated cart sizes")
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        outfits = list(Outfit.objects.filter(is_active=True).order_by('pk')[:max(sizes)])
+        if len(outfits) < max(sizes):
+            raise CommandError(f"Need at least {max(sizes)} active outfits, found {len(outfits)}.")
+
+        self.stdout.write(f"{'lines':>6} {'queries':>8} {'ms/order':>10}")
+        for size in sizes:
+            timings, queries = [], 0
+            for _ in range(options['repeat']):
+                elapsed, queries = self.run_once(outfits[:size])
+                timings.append(elapsed)
+            timings.sort()
+            median = timings[len(timings) // 2] * 1000
+            self.stdout.write(f"{size:>6} {queries:>8} {median:>10.2f}")
+
+    def run_once(self, outfits):
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(f'benchmark-{uuid.uuid4().hex[:12]}')
+                Profile.objects.get_or_create(user=user)
+                Cart.objects.bulk_create([Cart(user=user, outfit=outfit, quantity=2) for outfit in outfits])
+                user = User.objects.select_related('profile').get(pk=user.pk)
+
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    order, created = place_order(user, idempotency_key=uuid.uuid4().hex)
+                    elapsed = time.perf_counter() - start
+                if not created:
+                    raise CommandError("Checkout did not create an order.")
+                raise Rollback
+        except Rollback:
+            pass
+        return elapsed, len(captured.captured_queries)
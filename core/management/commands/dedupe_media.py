@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from core import dedupe
+from core.management.commands.sweep_stale_rows import format_bytes
+
+
+class Command(BaseCommand):
+    help = (
+        "Move uploaded images to content-hash names, storing identical files once "
+        "and rewriting every reference to them"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Names per UPDATE")
+        parser.add_argument('--keep-originals', action='store_true', help="Don't delete the old files")
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would change")
+
+    def handle(self, *args, **options):
+        result = dedupe.dedupe(
+            dry_run=options['dry_run'],
+            keep_originals=options['keep_originals'],
+            batch_size=options['batch_size'],
+        )
+        for name in result.missing:
+            self.stderr.write(f"{name}: referenced but not in storage, left as is")
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f"{result.files} files would become {result.stored} and {result.copies} stray copies "
+                f"would be deleted, freeing {format_bytes(result.freed)}."
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"{result.files} files stored as {result.stored}; {result.rows} image fields and "
+                f"{result.receipts} receipts rewritten; "
+                + (f"originals and {result.copies} stray copies kept (--keep-originals)."
+                   if options['keep_originals'] else
+                   f"{result.copies} stray copies deleted, {format_bytes(result.freed)} freed.")
+            ))
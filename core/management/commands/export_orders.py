@@ -0,0 +1,37 @@
+import csv
+import sys
+
+from django.core.management.base import BaseCommand
+
+from core.models import Order
+
+
+class Command(BaseCommand):
+    help = "Export order lines as CSV, read from the receipt snapshots (one row per line)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="File to write; defaults to stdout")
+        parser.add_argument('--status', help="Only orders with this status")
+
+    def handle(self, *args, **options):
+        orders = Order.objects.order_by('pk').values_list(
+            'pk', 'created_at', 'status', 'customer__user__username', 'payment_method', 'receipt',
+        )
+        if options['status']:
+            orders = orders.filter(status=options['status'])
+
+        out = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        try:
+            writer = csv.writer(out)
+            writer.writerow(['order', 'created_at', 'status', 'customer', 'payment_method',
+                             'outfit_id', 'outfit', 'unit_price', 'quantity', 'line_total', 'order_total'])
+            for pk, created_at, status, customer, payment_method, receipt in orders.iterator(chunk_size=2000):
+                for line in receipt.get('lines', []):
+                    writer.writerow([
+                        pk, created_at.isoformat(), status, customer or '', payment_method,
+                        line['outfit_id'] or '', line['name'], line['unit_price'], line['quantity'],
+                        line['line_total'], receipt['total'],
+                    ])
+        finally:
+            if out is not sys.stdout:
+                out.close()
@@ -0,0 +1,38 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from core import images
+from core.models import ImageDerivative
+
+
+class Command(BaseCommand):
+    help = "Create the resized/WebP derivatives for every image in the media library"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Regenerate derivatives that already exist")
+
+    def handle(self, *args, **options):
+        existing = set(ImageDerivative.objects.values_list('source', flat=True).distinct())
+        made = skipped = failed = 0
+        original_bytes = card_bytes = 0
+        for source in images.all_sources():
+            if source in existing and not options['force']:
+                skipped += 1
+                continue
+            rows = images.generate(source, force=options['force'])
+            if rows:
+                images.derivatives_ready(source)
+                made += 1
+                size = default_storage.size(source)
+                card = min((row.bytes for row in rows if row.format == 'webp'), default=size)
+                original_bytes += size
+                card_bytes += card
+                self.stdout.write(f"{source}: {len(rows)} derivatives, {size // 1024} KB -> {card // 1024} KB per card")
+            else:
+                failed += 1
+                self.stderr.write(f"{source}: not readable as an image")
+
+        summary = f"{made} images processed, {skipped} already done, {failed} failed."
+        if made:
+            summary += f" Cards now download {card_bytes // 1024} KB instead of {original_bytes // 1024} KB."
+        self.stdout.write(self.style.SUCCESS(summary))
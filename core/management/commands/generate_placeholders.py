@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import images, placeholders
+from core.models import ImagePlaceholder
+
+
+class Command(BaseCommand):
+    help = "Compute the inline blurred placeholders for every outfit and category image"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=placeholders.BATCH_SIZE)
+        parser.add_argument('--force', action='store_true', help="Recompute placeholders that already exist")
+
+    def handle(self, *args, **options):
+        existing = set(ImagePlaceholder.objects.values_list('source', flat=True))
+        found = list(placeholders.all_sources())
+        sources = [source for source in found if options['force'] or source not in existing]
+        started = time.monotonic()
+        made = inlined = 0
+        for start in range(0, len(sources), options['batch_size']):
+            rows = placeholders.generate(sources[start:start + options['batch_size']])
+            if rows:
+                images.refresh_pages([row.source for row in rows])
+            made += len(rows)
+            inlined += sum(len(row.data_uri) for row in rows)
+
+        summary = (
+            f"{made} placeholders made, {len(found) - len(sources)} already done, "
+            f"{len(sources) - made} unreadable, in {time.monotonic() - started:.2f}s."
+        )
+        if made:
+            summary += f" About {inlined // made} bytes inlined per card."
+        self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,111 @@
+import json
+import threading
+import uuid
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+
+# What the stub does is picked by the last digit of the paying phone number,
+# so every branch of the payment flow can be driven from the order page.
+SCENARIOS = {
+    '1': 'declined',   # the customer cancels the prompt
+    '2': 'no_answer',  # no callback ever arrives -> timed out by process_payments
+    '3': 'flaky',      # the first two pushes get HTTP 503 -> retried with backoff
+    '4': 'duplicate',  # the success callback is delivered twice
+}
+
+
+class Command(BaseCommand):
+    help = "Run a local stand-in for the M-Pesa STK push gateway, for testing payments offline"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--delay', type=float, default=3.0, help="Seconds before the callback is sent")
+
+    def handle(self, *args, **options):
+        command = self
+        delay = options['delay']
+        rejected = {}
+        lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path.rstrip('/') != '/stkpush':
+                    return self.reply(404, {'errorMessage': 'Not found'})
+                try:
+                    push = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                    phone, callback_url = push['PhoneNumber'], push['CallBackURL']
+                except (ValueError, KeyError):
+                    return self.reply(400, {'errorMessage': 'Bad request'})
+
+                scenario = SCENARIOS.get(str(phone)[-1], 'success')
+                if scenario == 'flaky':
+                    with lock:
+                        rejected[phone] = rejected.get(phone, 0) + 1
+                        if rejected[phone] <= 2:
+                            command.stdout.write(f"push for {phone}: 503")
+                            return self.reply(503, {'errorMessage': 'Service unavailable'})
+
+                checkout_id = f'ws_CO_{uuid.uuid4().hex[:20]}'
+                command.stdout.write(f"push for {phone}, Ksh {push.get('Amount')}: {scenario} ({checkout_id})")
+                self.reply(200, {
+                    'MerchantRequestID': uuid.uuid4().hex[:12],
+                    'CheckoutRequestID': checkout_id,
+                    'ResponseCode': '0',
+                    'ResponseDescription': 'Success. Request accepted for processing',
+                    'CustomerMessage': 'Success. Request accepted for processing',
+                })
+                if scenario != 'no_answer':
+                    copies = 2 if scenario == 'duplicate' else 1
+                    result = callback_body(checkout_id, push, declined=scenario == 'declined')
+                    for copy in range(copies):
+                        threading.Timer(delay + copy, send_callback, (callback_url, result)).start()
+
+            def reply(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        def send_callback(url, body):
+            request = urllib.request.Request(
+                url, data=json.dumps(body).encode(), headers={'Content-Type': 'application/json'}, method='POST',
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=10) as response:
+                    command.stdout.write(f"callback -> {response.status}")
+            except Exception as e:
+                command.stderr.write(f"callback to {url} failed: {e}")
+
+        server = ThreadingHTTPServer(('127.0.0.1', options['port']), Handler)
+        self.stdout.write(f"M-Pesa stub gateway on http://127.0.0.1:{options['port']}/stkpush (Ctrl+C to stop)")
+        self.stdout.write("Phone ending in 1: declined, 2: no answer, 3: flaky gateway, 4: duplicate callback, else paid")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+def callback_body(checkout_id, push, declined=False):
+    result = {
+        'MerchantRequestID': uuid.uuid4().hex[:12],
+        'CheckoutRequestID': checkout_id,
+        'ResultCode': 1032 if declined else 0,
+        'ResultDesc': 'Request cancelled by user' if declined else 'The service request is processed successfully.',
+    }
+    if not declined:
+        result['CallbackMetadata'] = {'Item': [
+            {'Name': 'Amount', 'Value': push.get('Amount')},
+            {'Name': 'MpesaReceiptNumber', 'Value': uuid.uuid4().hex[:10].upper()},
+            {'Name': 'PhoneNumber', 'Value': int(push['PhoneNumber'])},
+        ]}
+    return {'Body': {'stkCallback': result}}
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import payments
+
+
+class Command(BaseCommand):
+    help = (
+        "Send queued M-Pesa pushes (including retries), time out unanswered ones "
+        "and cancel abandoned unpaid orders. Run from cron, or with --loop."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep running")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds between passes with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            sent = payments.send_due()
+            timed_out, requeued = payments.expire_stale()
+            cancelled = payments.cancel_abandoned()
+            if sent or timed_out or requeued or cancelled or not options['loop']:
+                self.stdout.write(
+                    f"sent {sent}, timed out {timed_out}, requeued {requeued}, cancelled {cancelled} unpaid orders"
+                )
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
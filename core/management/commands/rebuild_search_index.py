@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index for the outfit catalog"
+
+    def handle(self, *args, **options):
+        if not search.fts_enabled():
+            raise CommandError("Full-text search index is only available on SQLite.")
+        search.create_index()
+        total = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} outfits."))
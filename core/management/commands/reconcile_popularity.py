@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from core.models import Outfit, OrderItem
+
+
+class Command(BaseCommand):
+    help = "Backfill and reconcile Outfit.order_count / units_sold from OrderItem"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help="Report drift without writing")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        # One grouped pass over OrderItem
+        totals = {
+            row['outfit']: (row['orders'], row['units'] or 0)
+            for row in OrderItem.objects.exclude(outfit=None)
+            .values('outfit')
+            .annotate(orders=Count('order', distinct=True), units=Sum('quantity'))
+            .order_by()
+        }
+
+        changed = []
+        checked = 0
+        outfits = Outfit.objects.only('id', 'order_count', 'units_sold').order_by('pk')
+        for outfit in outfits.iterator(chunk_size=2000):
+            checked += 1
+            orders, units = totals.get(outfit.pk, (0, 0))
+            if (outfit.order_count, outfit.units_sold) != (orders, units):
+                outfit.order_count, outfit.units_sold = orders, units
+                changed.append(outfit)
+
+        if changed and not options['dry_run']:
+            with transaction.atomic():
+                Outfit.objects.bulk_update(changed, ['order_count', 'units_sold'], batch_size=batch_size)
+
+        verb = "would be updated" if options['dry_run'] else "updated"
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} outfits, {len(changed)} {verb}."))
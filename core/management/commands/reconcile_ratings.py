@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core import ratings
+from core.models import Outfit, Review
+
+
+class Command(BaseCommand):
+    help = "Rebuild per-outfit rating summaries (average, count, star histogram) from Review"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help="Report drift without writing")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            checked, changed = ratings.reconcile(
+                Outfit.objects.all(), Review.objects.all(),
+                batch_size=options['batch_size'], dry_run=options['dry_run'],
+            )
+        verb = "would be updated" if options['dry_run'] else "updated"
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} outfits, {changed} {verb}."))
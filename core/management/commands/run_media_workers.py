@@ -0,0 +1,74 @@
+import logging
+import multiprocessing
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+# Spawned workers start from a fresh interpreter and unpickle these functions
+# by importing this module, so it mustn't import models at the top.
+def setup_worker():
+    import django
+    django.setup()
+
+
+def run_job(job_id):
+    from core import jobs
+    close_old_connections()
+    try:
+        return jobs.execute(job_id)
+    except Exception:
+        # left 'running'; requeue_stale() hands it out again later
+        logger.exception("Media job %s crashed", job_id)
+        return 'crashed'
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = (
+        "Process queued media jobs (image derivatives) in a pool of worker processes. "
+        "Runs until stopped, or with --once until the queue is empty."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=min(4, os.cpu_count() or 1))
+        parser.add_argument('--batch', type=int, default=4, help="Jobs claimed per process on each pass")
+        parser.add_argument('--poll', type=float, default=2.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument('--once', action='store_true', help="Exit once no job is due")
+
+    def handle(self, *args, **options):
+        from core import jobs
+        processes = max(options['processes'], 1)
+        worker = jobs.worker_name()
+        # spawn rather than fork: a forked child would share the parent's database connection
+        context = multiprocessing.get_context('spawn')
+        self.stdout.write(f"Media workers: {processes} processes ({worker})")
+
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=setup_worker) as pool:
+            try:
+                while True:
+                    requeued = jobs.requeue_stale()
+                    if requeued:
+                        self.stdout.write(f"requeued {requeued} jobs left running by a stopped worker")
+                    job_ids = jobs.claim(processes * options['batch'], worker=worker)
+                    if not job_ids:
+                        if options['once']:
+                            break
+                        time.sleep(options['poll'])
+                        continue
+                    started = time.monotonic()
+                    statuses = Counter(pool.map(run_job, job_ids))
+                    self.stdout.write(
+                        f"{len(job_ids)} jobs in {time.monotonic() - started:.1f}s: "
+                        + ", ".join(f"{count} {status}" for status, count in sorted(statuses.items()))
+                    )
+            except KeyboardInterrupt:
+                released = jobs.release(worker)
+                self.stdout.write(f"Stopping; {released} unfinished jobs put back in the queue.")
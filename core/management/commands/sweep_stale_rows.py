@@ -0,0 +1,61 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core import housekeeping
+
+
+def format_bytes(size):
+    if size is None:
+        return "n/a"
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+class Command(BaseCommand):
+    help = "Delete abandoned cart, compare and wishlist rows in small batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cart-days', type=int, default=60, help="Cart lines older than this are abandoned")
+        parser.add_argument('--compare-days', type=int, default=30)
+        parser.add_argument('--wishlist-days', type=int, default=365)
+        parser.add_argument('--only', choices=sorted(housekeeping.SWEEPABLE), action='append',
+                            help="Sweep only this table (repeatable)")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0.05, help="Seconds to sleep between batches")
+        parser.add_argument('--archive', help="Append the deleted rows to this file as JSON lines")
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be deleted")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        names = options['only'] or list(housekeeping.SWEEPABLE)
+        archive = open(options['archive'], 'a') if options['archive'] and not options['dry_run'] else None
+        try:
+            total_rows, total_bytes = 0, 0
+            for name in names:
+                cutoff = now - timedelta(days=options[f'{name}_days'])
+                result = housekeeping.sweep(
+                    name, cutoff,
+                    batch_size=options['batch_size'],
+                    dry_run=options['dry_run'],
+                    pause=options['pause'],
+                    archive=archive,
+                )
+                total_rows += result.rows
+                total_bytes += result.bytes or 0
+                if options['dry_run']:
+                    self.stdout.write(f"{name}: {result.rows} rows older than {cutoff:%Y-%m-%d} "
+                                      f"would be deleted (~{format_bytes(result.bytes)})")
+                else:
+                    self.stdout.write(f"{name}: deleted {result.rows} rows in {result.batches} batches, "
+                                      f"{format_bytes(result.bytes)} freed")
+        finally:
+            if archive is not None:
+                archive.close()
+
+        verb = "would be deleted" if options['dry_run'] else "deleted"
+        self.stdout.write(self.style.SUCCESS(f"{total_rows} rows {verb}, ~{format_bytes(total_bytes)}."))
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-18 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_outfit_brand_outfit_color_outfit_material_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='outfit',
+            index=models.Index(fields=['is_active', '-created_at', '-id'], name='outfit_feed_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.7 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_outfit_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outfit',
+            name='order_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='outfit',
+            name='units_sold',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='outfit',
+            index=models.Index(fields=['category', 'is_active', '-order_count'], name='outfit_popular_idx'),
+        ),
+    ]
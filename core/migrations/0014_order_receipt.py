@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2026-10-18 10:19
+
+from django.db import migrations, models
+
+
+def backfill_receipts(apps, schema_editor):
+    from core import orders
+
+    Order = apps.get_model('core', 'Order')
+    OrderItem = apps.get_model('core', 'OrderItem')
+    batch = []
+    queryset = Order.objects.prefetch_related(
+        models.Prefetch('items', queryset=OrderItem.objects.select_related('outfit').order_by('pk'))
+    ).order_by('pk')
+    for order in queryset.iterator(chunk_size=500):
+        order.receipt = orders.build_receipt(list(order.items.all()))
+        batch.append(order)
+        if len(batch) >= 500:
+            Order.objects.bulk_update(batch, ['receipt'])
+            batch = []
+    Order.objects.bulk_update(batch, ['receipt'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_order_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='receipt',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(backfill_receipts, migrations.RunPython.noop),
+    ]
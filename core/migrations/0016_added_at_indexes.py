@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-18 10:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_payment_attempt'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cart',
+            name='added_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='compare',
+            name='added_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='wishlist',
+            name='added_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
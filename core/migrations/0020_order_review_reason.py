@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 10:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_image_placeholder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='review_reason',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+    ]
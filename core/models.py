@@ -1,7 +1,7 @@
 from django.conf import settings
 from django.db import models
 from django.urls import reverse
-from django.core.validators import MinValueValidator
+from django.core.validators import MinValueValidator, MaxValueValidator
 
 User = settings.AUTH_USER_MODEL  # 'auth.User' by default
 
@@ -23,6 +23,7 @@ class Category(models.Model):
     image = models.ImageField(upload_to='categories/', null=True, blank=True)
     color = models.CharField(max_length=20, default='blue')  # for category color coding
     featured = models.BooleanField(default=False)  # for featured categories
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -44,6 +45,28 @@ class Outfit(models.Model):
     color = models.CharField(max_length=50, blank=True, null=True)
     size = models.CharField(max_length=20, blank=True, null=True)
     material = models.CharField(max_length=100, blank=True, null=True)
+    # Inventory (see core.inventory); empty stock means the outfit isn't stock-tracked
+    stock = models.PositiveIntegerField(null=True, blank=True)
+    reserved = models.PositiveIntegerField(default=0, editable=False)
+    # Popularity counters, bumped at checkout (see reconcile_popularity to rebuild them)
+    order_count = models.PositiveIntegerField(default=0, editable=False)
+    units_sold = models.PositiveIntegerField(default=0, editable=False)
+    # Rating summary, maintained incrementally from Review (see core.ratings / reconcile_ratings)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    ratings_1 = models.PositiveIntegerField(default=0, editable=False)
+    ratings_2 = models.PositiveIntegerField(default=0, editable=False)
+    ratings_3 = models.PositiveIntegerField(default=0, editable=False)
+    ratings_4 = models.PositiveIntegerField(default=0, editable=False)
+    ratings_5 = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # keyset pagination of the outfit feed walks this index newest-first
+            models.Index(fields=['is_active', '-created_at', '-id'], name='outfit_feed_idx'),
+            # "Most Popular" sort within a category
+            models.Index(fields=['category', 'is_active', '-order_count'], name='outfit_popular_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -51,6 +74,29 @@ class Outfit(models.Model):
     def get_absolute_url(self):
         return reverse('outfit_detail', args=[str(self.pk)])
 
+    @property
+    def average_rating(self):
+        if not self.rating_count:
+            return 0
+        return self.rating_sum / self.rating_count
+
+    @property
+    def available(self):
+        """Units not held by anyone's reservation; None when stock isn't tracked."""
+        if self.stock is None:
+            return None
+        return max(self.stock - self.reserved, 0)
+
+    @property
+    def rating_histogram(self):
+        """[{'rating': 5, 'count': n, 'percent': p}, ...] from 5 stars down to 1."""
+        histogram = []
+        for stars in range(5, 0, -1):
+            count = getattr(self, f'ratings_{stars}')
+            percent = round(100 * count / self.rating_count) if self.rating_count else 0
+            histogram.append({'rating': stars, 'count': count, 'percent': percent})
+        return histogram
+
 
 class Cart(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -59,7 +105,7 @@ class Cart(models.Model):
         default=1,
         validators=[MinValueValidator(1)]
     )
-    added_at = models.DateTimeField(auto_now_add=True)
+    added_at = models.DateTimeField(auto_now_add=True, db_index=True)  # swept by sweep_stale_rows
 
     class Meta:
         unique_together = ('user', 'outfit')  # Prevents duplicate items
@@ -73,10 +119,25 @@ class Cart(models.Model):
     def total_price(self):
         return self.outfit.price * self.quantity
 
+class StockReservation(models.Model):
+    """Units of an outfit held for a shopper's cart until expires_at (see core.inventory)."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='stock_reservations')
+    outfit = models.ForeignKey('Outfit', on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'outfit'], name='unique_stock_reservation'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity}x {self.outfit} held for {self.user} until {self.expires_at}"
+
 class Wishlist(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     outfit = models.ForeignKey('Outfit', on_delete=models.CASCADE)
-    added_at = models.DateTimeField(auto_now_add=True)
+    added_at = models.DateTimeField(auto_now_add=True, db_index=True)  # swept by sweep_stale_rows
 
     class Meta:
         unique_together = ('user', 'outfit')  # Prevents duplicates
@@ -89,7 +150,7 @@ class Wishlist(models.Model):
 class Compare(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     outfit = models.ForeignKey('Outfit', on_delete=models.CASCADE)
-    added_at = models.DateTimeField(auto_now_add=True)
+    added_at = models.DateTimeField(auto_now_add=True, db_index=True)  # swept by sweep_stale_rows
 
     class Meta:
         unique_together = ('user', 'outfit')  # Prevents duplicates
@@ -124,10 +185,30 @@ class Order(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     payment_method = models.CharField(max_length=50, default='mpesa')
+    # Client-supplied key so a retried/double-submitted checkout returns the same order
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True, editable=False)
+    # Receipt snapshot written once at checkout (see core.orders.build_receipt);
+    # order pages and exports read this instead of joining OrderItem/Outfit
+    receipt = models.JSONField(default=dict, blank=True, editable=False)
+    # Set by core.payments when a payment needs staff to sort it out (late, wrong amount)
+    review_reason = models.CharField(max_length=255, blank=True, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'idempotency_key'], name='unique_order_idempotency_key'),
+        ]
+        indexes = [
+            # keyset pagination of a customer's order history, newest first
+            models.Index(fields=['customer', '-created_at', '-id'], name='order_history_idx'),
+        ]
 
     def __str__(self):
         return f"Order #{self.pk} - {self.customer.user.username if self.customer else 'Unknown'}"
 
+    @property
+    def receipt_lines(self):
+        return self.receipt.get('lines', [])
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
@@ -139,10 +220,127 @@ class OrderItem(models.Model):
         return f"{self.outfit} x {self.quantity}"
 
 
+class PaymentAttempt(models.Model):
+    """One M-Pesa STK push for an order (see core.payments)."""
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),        # waiting to be sent to the gateway
+        ('sending', 'Sending'),      # claimed by a worker
+        ('sent', 'Sent'),            # accepted by the gateway, waiting for its callback
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+        ('timed_out', 'Timed out'),
+    )
+    FINAL_STATUSES = ('succeeded', 'failed', 'timed_out')
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='payment_attempts')
+    phone = models.CharField(max_length=15)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    # Secret part of the callback URL, so only the gateway we called can report back
+    callback_token = models.CharField(max_length=64, unique=True)
+    checkout_request_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
+    send_tries = models.PositiveSmallIntegerField(default=0)
+    next_try_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    result_code = models.CharField(max_length=20, blank=True)
+    result_description = models.CharField(max_length=255, blank=True)
+    receipt_number = models.CharField(max_length=50, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # the payment worker polls for due and stale attempts by status
+            models.Index(fields=['status', 'next_try_at'], name='payment_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"Payment for order #{self.order_id} ({self.status})"
+
+    @property
+    def is_final(self):
+        return self.status in self.FINAL_STATUSES
+
+
+class ImageDerivative(models.Model):
+    """A resized copy of an uploaded image (see core.images)."""
+    FORMAT_CHOICES = (
+        ('webp', 'WebP'),
+        ('jpeg', 'JPEG'),
+    )
+    source = models.CharField(max_length=255, db_index=True)  # storage name of the original
+    width = models.PositiveIntegerField()  # the preset width this derivative was made for
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    path = models.CharField(max_length=255)
+    actual_width = models.PositiveIntegerField()
+    actual_height = models.PositiveIntegerField()
+    bytes = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'width', 'format'], name='unique_image_derivative'),
+        ]
+
+    def __str__(self):
+        return f"{self.source} @{self.width}w {self.format}"
+
+
+class ImagePlaceholder(models.Model):
+    """A tiny blurred preview of an uploaded image, inlined by the cards (see core.placeholders)."""
+    source = models.CharField(max_length=255, unique=True)  # storage name of the original
+    data_uri = models.TextField()
+    color = models.CharField(max_length=7)  # average colour, '#rrggbb'
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.source
+
+
+class MediaJob(models.Model):
+    """A unit of background media work, run by run_media_workers (see core.jobs)."""
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    kind = models.CharField(max_length=30)
+    source = models.CharField(max_length=255)  # storage name of the image to work on
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField()
+    locked_at = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # workers claim the oldest due jobs
+            models.Index(fields=['status', 'run_after'], name='media_job_due_idx'),
+        ]
+        constraints = [
+            # one outstanding job per image; finished ones don't count
+            models.UniqueConstraint(
+                fields=['kind', 'source'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='unique_pending_media_job',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.source} ({self.status})"
+
+
 class Review(models.Model):
     outfit = models.ForeignKey(Outfit, on_delete=models.CASCADE, related_name='reviews')
     reviewer = models.ForeignKey(Profile, on_delete=models.SET_NULL, null=True)
-    rating = models.PositiveSmallIntegerField(default=5)
+    rating = models.PositiveSmallIntegerField(
+        default=5,
+        validators=[MinValueValidator(1), MaxValueValidator(5)]
+    )
     comment = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -0,0 +1,137 @@
+"""
+Checkout pipeline.
+
+place_order() turns a user's cart into an Order in one transaction with a
+fixed number of queries, whatever the number of cart lines:
+lock the cart, read it with outfits joined, take the stock (see
+core.inventory), insert the order, bulk-insert its items, bump the
+popularity counters in one UPDATE and clear the cart.
+An idempotency key makes retries and double submits return the order that
+was already placed instead of creating a second one.
+
+Each order also stores a receipt: a JSON snapshot of what was bought, at
+what price, written once here. Order pages and exports render from it
+alone, so they cost one query and survive the outfits being edited or
+deleted later.
+"""
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from . import cart, inventory
+from .models import Cart, Order, OrderItem, Outfit
+
+RECEIPT_VERSION = 1
+
+
+def build_receipt(order_items):
+    """
+    The receipt snapshot for a list of OrderItems (outfits loaded). Money is
+    stored as strings so the Decimals round-trip through JSON exactly.
+    """
+    lines = []
+    for item in order_items:
+        outfit = item.outfit
+        lines.append({
+            'outfit_id': outfit.pk if outfit else None,
+            'name': outfit.name if outfit else '',
+            'image': outfit.image.name if outfit and outfit.image else '',
+            'unit_price': str(item.price),
+            'quantity': item.quantity,
+            'line_total': str(item.price * item.quantity),
+        })
+    return {
+        'version': RECEIPT_VERSION,
+        'lines': lines,
+        'item_count': sum(line['quantity'] for line in lines),
+        'total': str(sum((item.price * item.quantity for item in order_items), Decimal('0'))),
+    }
+
+
+def existing_order(profile, idempotency_key):
+    if not idempotency_key:
+        return None
+    return Order.objects.filter(customer=profile, idempotency_key=idempotency_key).first()
+
+
+def lock_cart(user):
+    """
+    Lock the user's cart rows for the rest of the transaction.
+    select_for_update() covers databases with row locks; on SQLite it is a
+    no-op, so the no-op UPDATE takes the database write lock up front and a
+    concurrent checkout waits instead of reading the same cart.
+    """
+    Cart.objects.filter(user=user).update(quantity=F('quantity'))
+    return list(
+        Cart.objects.select_for_update()
+        .filter(user=user)
+        .select_related('outfit')
+        .order_by('pk')
+    )
+
+
+def bump_popularity(lines):
+    """One UPDATE for every outfit in the order instead of one per line."""
+    units = Case(
+        *(When(pk=outfit_id, then=Value(quantity)) for outfit_id, quantity in lines.items()),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    Outfit.objects.filter(pk__in=lines).update(
+        order_count=F('order_count') + 1,
+        units_sold=F('units_sold') + units,
+    )
+
+
+def place_order(user, idempotency_key=None, payment_method='mpesa'):
+    """
+    Returns (order, created). order is None when the cart is empty and no
+    order exists for the key. Raises inventory.OutOfStock, leaving the cart
+    as it was, when a stock-tracked outfit can't cover its line.
+    """
+    profile = user.profile
+    idempotency_key = (idempotency_key or '')[:64] or None
+
+    try:
+        with transaction.atomic():
+            order = existing_order(profile, idempotency_key)
+            if order is not None:
+                return order, False
+
+            items = lock_cart(user)
+            if not items:
+                return None, False
+            inventory.take_stock(user, items)
+
+            # prices are snapshotted here; later price changes don't touch the order
+            order_items = [
+                OrderItem(outfit=item.outfit, quantity=item.quantity, price=item.outfit.price)
+                for item in items
+            ]
+            receipt = build_receipt(order_items)
+            order = Order.objects.create(
+                customer=profile,
+                total_amount=Decimal(receipt['total']),
+                payment_method=payment_method,
+                idempotency_key=idempotency_key,
+                receipt=receipt,
+            )
+            for order_item in order_items:
+                order_item.order = order
+            OrderItem.objects.bulk_create(order_items)
+
+            lines = {}
+            for item in items:
+                lines[item.outfit_id] = lines.get(item.outfit_id, 0) + item.quantity
+            bump_popularity(lines)
+
+            Cart.objects.filter(pk__in=[item.pk for item in items]).delete()
+            transaction.on_commit(lambda: cart.invalidate(user))
+    except IntegrityError:
+        # A concurrent request with the same key won the race; hand back its order
+        order = existing_order(profile, idempotency_key)
+        if order is None:
+            raise
+        return order, False
+    return order, True
@@ -0,0 +1,128 @@
+"""
+Full-page cache for anonymous visitors.
+
+Pages are cached per path plus the query params that actually change them
+(e.g. sort), and tagged with what they show ('outfit:12', 'category:3', ...).
+Every page rendering the category nav carries 'category_nav', which only
+Category changes purge; an outfit change purges its own page, its
+categories, the 'outfits' feed and the 'category_list' counts and previews.
+Every tag has a version number in the cache; a page is only served while
+the versions it was stored with are still current, so purging a tag is a
+single incr and only the pages carrying that tag go stale.
+
+CSRF tokens are rendered as a placeholder (see the page_cache_csrf context
+processor) and swapped for the visitor's own token on the way out, so a
+cached form still posts correctly for whoever receives it.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.http import urlencode
+
+PAGE_TIMEOUT = 60 * 10
+CSRF_PLACEHOLDER = '__page_cache_csrf_token__'
+
+
+def tag_key(tag):
+    return f'page_tag:{tag}'
+
+
+def page_key(request, params):
+    selected = sorted(
+        (name, value)
+        for name in params
+        for value in request.GET.getlist(name)
+    )
+    raw = f'{request.path}?{urlencode(selected)}'
+    return 'page:' + hashlib.md5(raw.encode()).hexdigest()
+
+
+def tag_versions(tags, create=False):
+    keys = {tag_key(tag): tag for tag in tags}
+    found = cache.get_many(keys)
+    versions = {tag: found.get(key) for key, tag in keys.items()}
+    if create:
+        for tag, version in versions.items():
+            if version is None:
+                # Start from the clock so a re-created tag never repeats an old version
+                cache.add(tag_key(tag), int(time.time() * 1000), None)
+                versions[tag] = cache.get(tag_key(tag))
+    return versions
+
+
+def purge(*tags):
+    """Invalidate every cached page carrying any of these tags."""
+    for tag in tags:
+        try:
+            cache.incr(tag_key(tag))
+        except ValueError:
+            # No version stored, so no page can still be valid for this tag
+            pass
+
+
+def purge_outfit(outfit_id, *category_ids):
+    purge('outfits', 'category_list', f'outfit:{outfit_id}',
+          *(f'category:{pk}' for pk in category_ids if pk))
+
+
+def is_cacheable(request):
+    return (
+        request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+        # pending flash messages must reach this visitor only
+        and 'messages' not in request.COOKIES
+    )
+
+
+def with_csrf_token(request, content):
+    if CSRF_PLACEHOLDER.encode() in content:
+        content = content.replace(CSRF_PLACEHOLDER.encode(), get_token(request).encode())
+    return content
+
+
+def cache_anonymous_page(params=(), tags=None, timeout=PAGE_TIMEOUT):
+    """
+    Cache a view's full response for anonymous visitors.
+
+    params: query parameters that change the page and so belong in the key.
+    tags:   callable(request, response, **kwargs) returning the tags the page depends on.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not is_cacheable(request):
+                return view_func(request, *args, **kwargs)
+
+            key = page_key(request, params)
+            entry = cache.get(key)
+            if entry is not None and tag_versions(entry['tags']) == entry['tags']:
+                response = HttpResponse(
+                    with_csrf_token(request, entry['content']),
+                    content_type=entry['content_type'],
+                )
+                response['X-Page-Cache'] = 'hit'
+                return response
+
+            request.page_cache_active = True
+            response = view_func(request, *args, **kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response = response.render()
+
+            if response.streaming:
+                return response
+            if response.status_code == 200:
+                page_tags = set(tags(request, response, **kwargs)) if tags else set()
+                cache.set(key, {
+                    'content': response.content,
+                    'content_type': response['Content-Type'],
+                    'tags': tag_versions(page_tags, create=True),
+                }, timeout)
+                response['X-Page-Cache'] = 'miss'
+            response.content = with_csrf_token(request, response.content)
+            return response
+        return wrapper
+    return decorator
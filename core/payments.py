@@ -0,0 +1,322 @@
+"""
+M-Pesa (STK push) payments.
+
+Paying never blocks a request on the gateway. start_payment() only records a
+queued PaymentAttempt; once the transaction commits the STK push is sent
+from a small background thread pool, and the process_payments command picks
+up anything that thread didn't get to (retries after gateway errors, with
+backoff, and attempts left behind by a restarted worker).
+
+The gateway answers later by POSTing to a per-attempt callback URL.
+handle_callback() is idempotent: the first result for an attempt counts and
+any repeat delivery is acknowledged and ignored. A successful payment moves
+the order from pending to processing. A declined or timed-out push leaves
+it pending so the customer can try again, until MAX_PAYMENT_ATTEMPTS have
+failed; then, as for orders left unpaid for UNPAID_ORDER_TIMEOUT, the order
+is cancelled and its stock put back. A payment the order can't simply take
+(an amount other than the one pushed, or money arriving after the order
+was cancelled or already paid) is recorded, and the order is flagged for
+review and the staff notified, so it can be refunded or reinstated.
+
+Requests and callbacks use the Daraja STK push shapes; run the mpesa_stub
+command for a local gateway that exercises the whole flow offline.
+"""
+import json
+import logging
+import re
+import secrets
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import ROUND_CEILING, Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.urls import reverse
+from django.utils import timezone
+
+from . import lifecycle
+from .models import Notification, Order, PaymentAttempt, Profile
+
+logger = logging.getLogger(__name__)
+
+GATEWAY_URL = getattr(settings, 'MPESA_GATEWAY_URL', 'http://127.0.0.1:8765')
+CALLBACK_BASE_URL = getattr(settings, 'MPESA_CALLBACK_BASE_URL', 'http://127.0.0.1:8000')
+SHORTCODE = getattr(settings, 'MPESA_SHORTCODE', '174379')
+
+SEND_TIMEOUT = 10  # seconds per gateway request
+MAX_SEND_TRIES = 4
+RETRY_BACKOFF = 5  # seconds, doubled after every failed send
+# STK prompts expire on the phone after about a minute; allow for slow callbacks
+CALLBACK_TIMEOUT = timedelta(minutes=3)
+STALE_SENDING = timedelta(minutes=1)
+MAX_PAYMENT_ATTEMPTS = 3
+UNPAID_ORDER_TIMEOUT = timedelta(hours=1)
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='mpesa')
+
+
+class GatewayError(Exception):
+    pass
+
+
+def normalise_phone(phone):
+    """'0712 345 678', '+254712345678' -> '254712345678'; raises ValidationError."""
+    digits = re.sub(r'\D', '', phone or '')
+    if digits.startswith('0'):
+        digits = '254' + digits[1:]
+    elif len(digits) == 9:
+        digits = '254' + digits
+    if not re.fullmatch(r'254[17]\d{8}', digits):
+        raise ValidationError("Enter a valid Safaricom number, e.g. 0712 345 678.")
+    return digits
+
+
+def gateway_request(path, payload):
+    request = urllib.request.Request(
+        GATEWAY_URL.rstrip('/') + path,
+        data=json.dumps(payload).encode(),
+        headers={'Content-Type': 'application/json'},
+        method='POST',
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=SEND_TIMEOUT) as response:
+            return json.loads(response.read() or b'{}')
+    except urllib.error.HTTPError as e:
+        raise GatewayError(f"Gateway returned HTTP {e.code}")
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        raise GatewayError(f"Gateway unreachable: {e}")
+
+
+def start_payment(order, phone):
+    """
+    Queue an STK push for a pending order and return its PaymentAttempt.
+    Asking again while an attempt is still in flight returns that attempt.
+    """
+    phone = normalise_phone(phone)
+    with transaction.atomic():
+        order = Order.objects.select_for_update().get(pk=order.pk)
+        if order.status != 'pending':
+            raise ValidationError("This order can no longer be paid.")
+        if order.review_reason:
+            raise ValidationError("A payment for this order is being checked by our staff.")
+        active = order.payment_attempts.exclude(status__in=PaymentAttempt.FINAL_STATUSES).first()
+        if active is not None:
+            return active
+        attempt = PaymentAttempt.objects.create(
+            order=order,
+            phone=phone,
+            amount=order.total_amount,
+            callback_token=secrets.token_urlsafe(32),
+            next_try_at=timezone.now(),
+        )
+        transaction.on_commit(lambda: dispatch(attempt.pk))
+    return attempt
+
+
+def dispatch(attempt_id):
+    _executor.submit(_send_in_background, attempt_id)
+
+
+def _send_in_background(attempt_id):
+    close_old_connections()
+    try:
+        send_attempt(attempt_id)
+    except Exception:
+        logger.exception("Sending payment attempt %s failed", attempt_id)
+    finally:
+        close_old_connections()
+
+
+def push_amount(attempt):
+    # M-Pesa only takes whole shillings
+    return int(attempt.amount.to_integral_value(rounding=ROUND_CEILING))
+
+
+def stk_payload(attempt):
+    return {
+        'BusinessShortCode': SHORTCODE,
+        'TransactionType': 'CustomerPayBillOnline',
+        'Amount': push_amount(attempt),
+        'PartyA': attempt.phone,
+        'PartyB': SHORTCODE,
+        'PhoneNumber': attempt.phone,
+        'CallBackURL': CALLBACK_BASE_URL.rstrip('/') + reverse('mpesa_callback', args=[attempt.callback_token]),
+        'AccountReference': f'ORDER{attempt.order_id}',
+        'TransactionDesc': f'Order #{attempt.order_id}',
+    }
+
+
+def send_attempt(attempt_id):
+    """Send one queued attempt to the gateway. Safe to call from several workers at once."""
+    now = timezone.now()
+    claimed = PaymentAttempt.objects.filter(pk=attempt_id, status='queued').update(
+        status='sending', send_tries=F('send_tries') + 1, updated_at=now,
+    )
+    if not claimed:
+        return  # someone else has it, or it's already done
+    attempt = PaymentAttempt.objects.get(pk=attempt_id)
+
+    try:
+        response = gateway_request('/stkpush', stk_payload(attempt))
+        if str(response.get('ResponseCode')) != '0' or not response.get('CheckoutRequestID'):
+            raise GatewayError(response.get('ResponseDescription') or "Push rejected by the gateway")
+    except GatewayError as e:
+        if attempt.send_tries >= MAX_SEND_TRIES:
+            finish(attempt_id, 'failed', result_code='send_failed', result_description=str(e))
+        else:
+            PaymentAttempt.objects.filter(pk=attempt_id, status='sending').update(
+                status='queued',
+                next_try_at=now + timedelta(seconds=RETRY_BACKOFF * 2 ** (attempt.send_tries - 1)),
+                result_description=str(e)[:255],
+                updated_at=now,
+            )
+        return
+
+    # The callback may already have landed; only move on from 'sending'
+    PaymentAttempt.objects.filter(pk=attempt_id).update(checkout_request_id=response['CheckoutRequestID'])
+    PaymentAttempt.objects.filter(pk=attempt_id, status='sending').update(
+        status='sent', sent_at=now, updated_at=now,
+    )
+
+
+def flag_for_review(order_id, reason):
+    """Mark an order for staff to sort out by hand and notify every staff member."""
+    Order.objects.filter(pk=order_id).update(review_reason=reason[:255])
+    message = f"Order #{order_id} needs review: {reason}"
+    staff = Profile.objects.filter(user__is_staff=True, user__is_active=True).values_list('pk', flat=True)
+    Notification.objects.bulk_create([Notification(user_id=pk, message=message[:255]) for pk in staff])
+    logger.warning(message)
+
+
+def amount_problem(attempt, amount):
+    """Why a successful callback's Amount can't pay for the attempt, or ''."""
+    try:
+        paid = Decimal(str(amount))
+    except (InvalidOperation, ValueError):
+        return f"the payment callback had no valid amount ({amount!r})"
+    if paid != push_amount(attempt):
+        return f"Ksh {paid} was paid, Ksh {push_amount(attempt)} was asked for"
+    return ''
+
+
+def finish(attempt_id, status, result_code='', result_description='', receipt_number='', amount=None):
+    """
+    Record an attempt's outcome and move its order on. Only the first outcome
+    counts; returns False when the attempt was already final. A success
+    whose amount is wrong, or that the order can no longer take, is kept
+    and the order flagged for review instead.
+    """
+    with transaction.atomic():
+        attempt = PaymentAttempt.objects.select_for_update().get(pk=attempt_id)
+        late_payment = attempt.status == 'timed_out' and status == 'succeeded'
+        if attempt.is_final and not late_payment:
+            return False
+        attempt.status = status
+        attempt.result_code = str(result_code)[:20]
+        attempt.result_description = str(result_description)[:255]
+        attempt.receipt_number = receipt_number[:50]
+        attempt.save(update_fields=['status', 'result_code', 'result_description', 'receipt_number', 'updated_at'])
+
+        if status == 'succeeded':
+            problem = amount_problem(attempt, amount)
+            if problem:
+                flag_for_review(attempt.order_id, f"payment {receipt_number}: {problem}")
+                return True
+            paid, _ = lifecycle.transition(Order.objects.filter(pk=attempt.order_id), 'processing')
+            if not paid:
+                # e.g. the customer paid after we had timed the push out and cancelled
+                current = Order.objects.filter(pk=attempt.order_id).values_list('status', flat=True).first()
+                flag_for_review(
+                    attempt.order_id,
+                    f"payment {receipt_number} of Ksh {amount} arrived when the order was {current}; "
+                    f"refund it or reinstate the order",
+                )
+        else:
+            failures = PaymentAttempt.objects.filter(
+                order_id=attempt.order_id, status__in=('failed', 'timed_out'),
+            ).count()
+            if failures >= MAX_PAYMENT_ATTEMPTS:
+                cancel_unpaid(attempt.order_id)
+    return True
+
+
+def cancel_unpaid(order_id):
+    """Cancel a pending order (which also puts its units back on the shelf)."""
+    cancelled, _ = lifecycle.transition(Order.objects.filter(pk=order_id, status='pending'), 'cancelled')
+    return bool(cancelled)
+
+
+def handle_callback(token, payload):
+    """
+    Apply a gateway callback. Returns False for an unknown token; repeat
+    deliveries of a result already recorded are accepted and ignored.
+    """
+    attempt_id = PaymentAttempt.objects.filter(callback_token=token).values_list('pk', flat=True).first()
+    if attempt_id is None:
+        return False
+    try:
+        result = payload['Body']['stkCallback']
+        result_code = str(result['ResultCode'])
+    except (KeyError, TypeError):
+        raise ValidationError("Malformed callback")
+
+    metadata = {
+        item.get('Name'): item.get('Value')
+        for item in (result.get('CallbackMetadata') or {}).get('Item', [])
+    }
+    if result_code == '0':
+        finish(attempt_id, 'succeeded', result_code, result.get('ResultDesc', ''),
+               receipt_number=str(metadata.get('MpesaReceiptNumber', '')),
+               amount=metadata.get('Amount'))
+    else:
+        finish(attempt_id, 'failed', result_code, result.get('ResultDesc', ''))
+    return True
+
+
+def send_due(now=None, limit=100):
+    """Send queued attempts whose (re)try time has come; returns how many were tried."""
+    now = now or timezone.now()
+    due = list(
+        PaymentAttempt.objects.filter(status='queued', next_try_at__lte=now)
+        .order_by('next_try_at')
+        .values_list('pk', flat=True)[:limit]
+    )
+    for attempt_id in due:
+        send_attempt(attempt_id)
+    return len(due)
+
+
+def expire_stale(now=None):
+    """
+    Time out pushes the gateway never called back about, and requeue
+    attempts a worker claimed but never finished sending.
+    Returns (timed_out, requeued).
+    """
+    now = now or timezone.now()
+    requeued = PaymentAttempt.objects.filter(
+        status='sending', updated_at__lt=now - STALE_SENDING,
+    ).update(status='queued', next_try_at=now, updated_at=now)
+
+    stale = PaymentAttempt.objects.filter(status='sent', sent_at__lt=now - CALLBACK_TIMEOUT).values_list('pk', flat=True)
+    timed_out = 0
+    for attempt_id in list(stale):
+        timed_out += finish(attempt_id, 'timed_out', result_description="No answer from the customer's phone")
+    return timed_out, requeued
+
+
+def cancel_abandoned(now=None):
+    """
+    Cancel orders left unpaid, with no payment in flight, for
+    UNPAID_ORDER_TIMEOUT. Orders flagged for review are left to the staff.
+    """
+    now = now or timezone.now()
+    abandoned = (
+        Order.objects.filter(status='pending', created_at__lt=now - UNPAID_ORDER_TIMEOUT, review_reason='')
+        .exclude(payment_attempts__status__in=('queued', 'sending', 'sent'))
+    )
+    cancelled, _ = lifecycle.transition(abandoned, 'cancelled')
+    return cancelled
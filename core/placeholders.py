@@ -0,0 +1,118 @@
+"""
+Low-quality image placeholders.
+
+Cards inline a tiny blurred preview of their image as the <img>'s CSS
+background (see {% responsive_image %}), so a listing paints its layout and
+colours straight away, with no extra request, while the real images load.
+
+generate() works on batches: each source is decoded at reduced size (JPEG
+draft mode skips most of the decoding work) and shrunk to the GRID, then the
+whole batch is stacked into one NumPy array that is blurred and averaged in
+a few vectorised operations. Each preview is stored as a WebP data URI of
+about a hundred bytes, with the average colour as a fallback.
+
+Placeholders are made with an image's derivatives (core.jobs) and for the
+existing library by the generate_placeholders command.
+"""
+import base64
+import hashlib
+import io
+import logging
+
+import numpy as np
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .models import Category, ImagePlaceholder, Outfit
+
+logger = logging.getLogger(__name__)
+
+# Stretched back to the card's shape by the browser, which also smooths it
+GRID = (16, 16)
+QUALITY = 50
+BATCH_SIZE = 64
+PLACEHOLDER_FIELDS = (
+    (Outfit, 'image'),
+    (Category, 'image'),
+)
+CACHE_TIMEOUT = 60 * 60 * 24
+PENDING_CACHE_TIMEOUT = 60
+
+
+def cache_key(source):
+    return 'image_placeholder:' + hashlib.md5(source.encode()).hexdigest()
+
+
+def load(source, storage):
+    with storage.open(source, 'rb') as handle:
+        image = Image.open(handle)
+        image.draft('RGB', (GRID[0] * 4, GRID[1] * 4))
+        image = ImageOps.exif_transpose(image)
+        return image.convert('RGB').resize(GRID, Image.BOX)
+
+
+def blur(batch):
+    """3x3 box blur of an (n, height, width, 3) batch, edges clamped."""
+    height, width = batch.shape[1:3]
+    padded = np.pad(batch, ((0, 0), (1, 1), (1, 1), (0, 0)), mode='edge')
+    return sum(padded[:, dy:dy + height, dx:dx + width] for dy in range(3) for dx in range(3)) / 9
+
+
+def encode(pixels):
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'WEBP', quality=QUALITY)
+    return 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+
+def generate(sources, storage=default_storage):
+    """Compute and store the placeholders of a batch of stored images; returns their rows."""
+    loaded, images = [], []
+    for source in sources:
+        try:
+            images.append(np.asarray(load(source, storage), dtype=np.float32))
+        except (OSError, UnidentifiedImageError) as e:
+            logger.warning("Can't make a placeholder of %s: %s", source, e)
+            continue
+        loaded.append(source)
+    if not loaded:
+        return []
+
+    batch = np.stack(images)
+    colors = batch.mean(axis=(1, 2)).round().astype(np.uint8)
+    previews = blur(batch).round().clip(0, 255).astype(np.uint8)
+
+    rows = [
+        ImagePlaceholder(source=source, data_uri=encode(pixels), color='#%02x%02x%02x' % tuple(color))
+        for source, pixels, color in zip(loaded, previews, colors)
+    ]
+    ImagePlaceholder.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['source'],
+        update_fields=['data_uri', 'color'],
+    )
+    cache.delete_many([cache_key(source) for source in loaded])
+    return rows
+
+
+def placeholder(source):
+    """(data_uri, color) for a stored image, or None until it has been made."""
+    key = cache_key(source)
+    found = cache.get(key)
+    if found is None:
+        row = ImagePlaceholder.objects.filter(source=source).values_list('data_uri', 'color').first()
+        found = tuple(row) if row else ()
+        cache.set(key, found, CACHE_TIMEOUT if found else PENDING_CACHE_TIMEOUT)
+    return found or None
+
+
+def all_sources():
+    """Every image name referenced by a PLACEHOLDER_FIELDS column, without duplicates."""
+    seen = set()
+    for model, field in PLACEHOLDER_FIELDS:
+        names = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True}).values_list(field, flat=True)
+        for name in names.distinct().iterator():
+            if name not in seen:
+                seen.add(name)
+                yield name
@@ -0,0 +1,61 @@
+from django.db.models import Count, F
+
+from .models import Outfit
+
+
+def rating_updates(rating, sign):
+    """F() expressions that add (sign=1) or remove (sign=-1) one rating from an outfit's summary."""
+    updates = {
+        'rating_count': F('rating_count') + sign,
+        'rating_sum': F('rating_sum') + sign * rating,
+    }
+    if 1 <= rating <= 5:
+        updates[f'ratings_{rating}'] = F(f'ratings_{rating}') + sign
+    return updates
+
+
+def add_rating(outfit_id, rating):
+    if outfit_id:
+        Outfit.objects.filter(pk=outfit_id).update(**rating_updates(rating, 1))
+
+
+def remove_rating(outfit_id, rating):
+    if outfit_id:
+        Outfit.objects.filter(pk=outfit_id).update(**rating_updates(rating, -1))
+
+
+SUMMARY_FIELDS = ['rating_count', 'rating_sum'] + [f'ratings_{stars}' for stars in range(1, 6)]
+
+
+def summaries_from_reviews(reviews):
+    """Rebuild {outfit_id: {field: value}} from a Review queryset with one grouped query."""
+    summaries = {}
+    rows = reviews.exclude(outfit=None).values_list('outfit_id', 'rating').annotate(n=Count('id')).order_by()
+    for outfit_id, rating, n in rows:
+        summary = summaries.setdefault(outfit_id, dict.fromkeys(SUMMARY_FIELDS, 0))
+        summary['rating_count'] += n
+        summary['rating_sum'] += rating * n
+        if 1 <= rating <= 5:
+            summary[f'ratings_{rating}'] += n
+    return summaries
+
+
+def reconcile(outfits, reviews, batch_size=500, dry_run=False):
+    """
+    Compare every outfit's stored summary with one rebuilt from reviews and
+    bulk-write the ones that drifted. Returns (checked, changed).
+    """
+    summaries = summaries_from_reviews(reviews)
+    empty = dict.fromkeys(SUMMARY_FIELDS, 0)
+    changed = []
+    checked = 0
+    for outfit in outfits.only('id', *SUMMARY_FIELDS).order_by('pk').iterator(chunk_size=2000):
+        checked += 1
+        summary = summaries.get(outfit.pk, empty)
+        if any(getattr(outfit, field) != value for field, value in summary.items()):
+            for field, value in summary.items():
+                setattr(outfit, field, value)
+            changed.append(outfit)
+    if changed and not dry_run:
+        outfits.model.objects.bulk_update(changed, SUMMARY_FIELDS, batch_size=batch_size)
+    return checked, len(changed)
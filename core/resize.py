@@ -0,0 +1,190 @@
+"""
+On-demand resized images for ad-hoc sizes.
+
+/media/r/<w>x<h>/<name> returns the stored image <name> scaled to fit
+<w>x<h> (0 for either side keeps the aspect ratio; both set crops to fill),
+as WebP when the browser accepts it and JPEG otherwise. The listing cards
+use the pre-made derivatives (core.images); this is for the odd sizes the
+admin thumbnails, compare table and quick view need. Only the SIZES those
+pages use are served, so a client can't make the server render (and cache)
+every size it cares to ask for.
+
+Each variant is made once and kept in RESIZE_CACHE_DIR, which is held
+under RESIZE_CACHE_MAX_BYTES by evicting the least recently used files:
+a hit touches the file's mtime, and when a write takes the directory over
+its cap the oldest files are deleted down to LOW_WATER of it. Hits, misses
+and evictions are counted in the cache (see stats()).
+"""
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+CACHE_DIR = getattr(settings, 'RESIZE_CACHE_DIR', os.path.join(settings.BASE_DIR, 'resize_cache'))
+MAX_BYTES = getattr(settings, 'RESIZE_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+LOW_WATER = 0.8
+MAX_DIMENSION = 2000
+SIZES = frozenset(getattr(settings, 'RESIZE_SIZES', ('96x96', '0x360', '600x0')))
+# don't rewrite a hot file's mtime on every hit; LRU only needs it roughly
+TOUCH_INTERVAL = 60
+FORMATS = {
+    'webp': {'format': 'WEBP', 'content_type': 'image/webp', 'options': {'quality': 80, 'method': 4}},
+    'jpeg': {'format': 'JPEG', 'content_type': 'image/jpeg', 'options': {'quality': 82, 'optimize': True, 'progressive': True}},
+}
+COUNTERS = ('hits', 'misses', 'evictions')
+
+_lock = threading.Lock()
+_usage = None  # bytes in CACHE_DIR as last seen by this process
+
+
+class ResizeError(Exception):
+    pass
+
+
+def count(name, delta=1):
+    key = f'resize_stats:{name}'
+    if not cache.add(key, delta, None):
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            pass
+
+
+def stats():
+    found = cache.get_many([f'resize_stats:{name}' for name in COUNTERS])
+    result = {name: found.get(f'resize_stats:{name}', 0) for name in COUNTERS}
+    requests = result['hits'] + result['misses']
+    result['hit_rate'] = round(result['hits'] / requests, 3) if requests else None
+    result['files'], result['bytes'] = disk_usage()
+    result['max_bytes'] = MAX_BYTES
+    return result
+
+
+def pick_format(accept):
+    return 'webp' if 'image/webp' in (accept or '') else 'jpeg'
+
+
+def cache_path(source, width, height, fmt, version):
+    key = hashlib.sha1(f'{source}|{width}x{height}|{fmt}|{version}'.encode()).hexdigest()
+    return os.path.join(CACHE_DIR, key[:2], f'{key}.{fmt}'), key
+
+
+def render(source, width, height, fmt):
+    try:
+        with default_storage.open(source, 'rb') as handle:
+            image = Image.open(handle)
+            image.load()
+    except (OSError, UnidentifiedImageError) as e:
+        raise ResizeError(f"Can't read {source}: {e}")
+
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    if width and height:
+        # never upscale: a smaller source gets the same crop, scaled down to fit it
+        scale = min(1, image.width / width, image.height / height)
+        box = (max(1, round(width * scale)), max(1, round(height * scale)))
+        image = ImageOps.fit(image, box, Image.LANCZOS)
+    else:
+        # never upscale; thumbnail() keeps the aspect ratio
+        image.thumbnail((width or MAX_DIMENSION, height or MAX_DIMENSION), Image.LANCZOS)
+    buffer = io.BytesIO()
+    spec = FORMATS[fmt]
+    image.save(buffer, spec['format'], **spec['options'])
+    return buffer.getvalue()
+
+
+def get(source, width, height, fmt):
+    """
+    An open file of the cached variant, made first if needed, and its cache
+    key (an ETag). Raises ResizeError for bad sizes or a source that isn't
+    an image. The file is opened here so eviction can't remove it first.
+    """
+    if f'{width}x{height}' not in SIZES:
+        raise ResizeError(f"Unsupported size {width}x{height}")
+    try:
+        version = default_storage.get_modified_time(source).timestamp()
+    except (OSError, SuspiciousFileOperation, NotImplementedError) as e:
+        raise ResizeError(f"No such image {source}: {e}")
+
+    path, key = cache_path(source, width, height, fmt, version)
+    try:
+        handle = open(path, 'rb')
+    except FileNotFoundError:
+        pass
+    else:
+        if time.time() - os.fstat(handle.fileno()).st_mtime > TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass  # evicted meanwhile; our open handle still reads it
+        count('hits')
+        return handle, key
+
+    data = render(source, width, height, fmt)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write then rename, so a concurrent reader never sees half a file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as out:
+        out.write(data)
+    os.replace(tmp, path)
+    handle = open(path, 'rb')
+    count('misses')
+    added(len(data))
+    return handle, key
+
+
+def cached_files():
+    for entry in os.scandir(CACHE_DIR) if os.path.isdir(CACHE_DIR) else ():
+        if entry.is_dir():
+            for file in os.scandir(entry.path):
+                if file.is_file() and not file.name.endswith('.tmp'):
+                    yield file
+
+
+def disk_usage():
+    files = total = 0
+    for file in cached_files():
+        files += 1
+        total += file.stat().st_size
+    return files, total
+
+
+def added(size):
+    global _usage
+    with _lock:
+        if _usage is None:
+            _usage = disk_usage()[1]
+        else:
+            _usage += size
+        if _usage > MAX_BYTES:
+            _usage = evict(int(MAX_BYTES * LOW_WATER))
+
+
+def evict(target):
+    """Delete the least recently used files until the cache holds at most target bytes."""
+    files = sorted(cached_files(), key=lambda file: file.stat().st_mtime)
+    total = sum(file.stat().st_size for file in files)
+    evicted = 0
+    for file in files:
+        if total <= target:
+            break
+        try:
+            size = file.stat().st_size
+            os.remove(file.path)
+        except FileNotFoundError:
+            continue  # another process evicted it first
+        total -= size
+        evicted += 1
+    if evicted:
+        count('evictions', evicted)
+    return total
+
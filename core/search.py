@@ -0,0 +1,165 @@
+"""
+Full-text search over the outfit catalog.
+
+On SQLite the catalog is mirrored into an FTS5 virtual table whose rowid is
+the outfit id, kept in sync by the Outfit post_save/post_delete signals.
+Other databases fall back to icontains lookups so the site still works.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Outfit
+
+SEARCH_TABLE = 'core_outfit_search'
+SEARCH_COLUMNS = ('name', 'description', 'brand', 'material', 'color')
+# bm25 column weights, same order as SEARCH_COLUMNS: a hit in the name beats one in the description
+COLUMN_WEIGHTS = (10.0, 1.0, 5.0, 3.0, 3.0)
+
+
+def fts_enabled(conn=None):
+    return (conn or connection).vendor == 'sqlite'
+
+
+def create_index(conn=None):
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+            f"{', '.join(SEARCH_COLUMNS)}, "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+
+
+def drop_index(conn=None):
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+def rebuild_index(conn=None):
+    """Repopulate the whole index from core_outfit in one INSERT ... SELECT."""
+    conn = conn or connection
+    columns = ', '.join(SEARCH_COLUMNS)
+    sources = ', '.join(f"COALESCE({column}, '')" for column in SEARCH_COLUMNS)
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, {columns}) "
+            f"SELECT id, {sources} FROM {Outfit._meta.db_table}"
+        )
+        cursor.execute(f"SELECT count(*) FROM {SEARCH_TABLE}")
+        return cursor.fetchone()[0]
+
+
+def index_outfit(outfit):
+    if not fts_enabled():
+        return
+    columns = ', '.join(SEARCH_COLUMNS)
+    values = [getattr(outfit, column) or '' for column in SEARCH_COLUMNS]
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [outfit.pk])
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, {columns}) VALUES (%s, {', '.join(['%s'] * len(values))})",
+            [outfit.pk, *values],
+        )
+
+
+def unindex_outfit(pk):
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [pk])
+
+
+def build_match(query):
+    """
+    Turn free text into a safe FTS5 MATCH expression.
+    Every word must match; the last one is a prefix so results show up while typing.
+    Returns '' when there is nothing searchable in the query.
+    """
+    terms = re.findall(r'\w+', query or '')
+    if not terms:
+        return ''
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def matching_ids_sql(match):
+    """Subquery of matching outfit ids, usable as pk__in without materialising the ids."""
+    return RawSQL(f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s", [match])
+
+
+def filter_outfits(queryset, query):
+    """Restrict an Outfit queryset to search hits (unranked). Used by the admin."""
+    if fts_enabled():
+        match = build_match(query)
+        if not match:
+            return queryset.none()
+        return queryset.filter(pk__in=matching_ids_sql(match))
+    lookup = Q()
+    for column in SEARCH_COLUMNS:
+        lookup |= Q(**{f'{column}__icontains': query})
+    return queryset.filter(lookup)
+
+
+class SearchResults:
+    """
+    Lazily evaluated, ranked search hits for active outfits.
+    Supports count() and slicing so it can be handed straight to a Paginator;
+    each page is one ranked LIMIT/OFFSET query plus one query for the outfits.
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.match = build_match(query)
+        self._count = None
+
+    def _base_sql(self):
+        return (
+            f"FROM {SEARCH_TABLE} JOIN {Outfit._meta.db_table} o ON o.id = {SEARCH_TABLE}.rowid "
+            f"WHERE {SEARCH_TABLE} MATCH %s AND o.is_active"
+        )
+
+    def count(self):
+        if self._count is None:
+            if not self.match:
+                self._count = 0
+            elif fts_enabled():
+                with connection.cursor() as cursor:
+                    cursor.execute(f"SELECT count(*) {self._base_sql()}", [self.match])
+                    self._count = cursor.fetchone()[0]
+            else:
+                self._count = self._fallback().count()
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start = key.start or 0
+        stop = key.stop if key.stop is not None else self.count()
+        if not self.match or stop <= start:
+            return []
+        if not fts_enabled():
+            return list(self._fallback()[start:stop])
+
+        weights = ', '.join(str(weight) for weight in COLUMN_WEIGHTS)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT o.id {self._base_sql()} "
+                f"ORDER BY bm25({SEARCH_TABLE}, {weights}) LIMIT %s OFFSET %s",
+                [self.match, stop - start, start],
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        outfits = Outfit.objects.select_related('designer__user', 'category').in_bulk(ids)
+        return [outfits[pk] for pk in ids if pk in outfits]
+
+    def _fallback(self):
+        queryset = Outfit.objects.filter(is_active=True).select_related('designer__user', 'category')
+        return filter_outfits(queryset, self.query).order_by('-created_at', '-id')
@@ -1,8 +1,10 @@
 # core/signals.py
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
 from django.contrib.auth.models import User
 from django.dispatch import receiver
-from .models import Profile
+from django.utils import timezone
+from .models import Profile, Category, Outfit, Review
+from . import search, facets, ratings, categories, page_cache, cart, images, jobs
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -12,3 +14,111 @@ def create_user_profile(sender, instance, created, **kwargs):
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):
     instance.profile.save()
+
+
+# Keep the full-text search index in step with the catalog
+@receiver(post_save, sender=Outfit)
+def index_outfit(sender, instance, **kwargs):
+    search.index_outfit(instance)
+
+@receiver(post_delete, sender=Outfit)
+def unindex_outfit(sender, instance, **kwargs):
+    search.unindex_outfit(instance.pk)
+
+
+# Facet counts are cached per category; drop them when one of its outfits changes
+@receiver(pre_save, sender=Outfit)
+def remember_outfit_state(sender, instance, **kwargs):
+    instance._previous_category_id = instance._previous_price = None
+    if instance.pk:
+        previous = Outfit.objects.filter(pk=instance.pk).values_list('category_id', 'price').first()
+        if previous:
+            instance._previous_category_id, instance._previous_price = previous
+
+@receiver(post_save, sender=Outfit)
+@receiver(post_delete, sender=Outfit)
+def invalidate_category_facets(sender, instance, **kwargs):
+    facets.invalidate(instance.category_id)
+    previous = getattr(instance, '_previous_category_id', None)
+    if previous != instance.category_id:
+        facets.invalidate(previous)
+    # Anonymous page cache: only pages showing this outfit or its categories
+    page_cache.purge_outfit(instance.pk, instance.category_id, previous)
+
+
+# A category page's Last-Modified must move forward when an outfit leaves it
+# (deactivated, deleted or moved), not fall back to the newest one left.
+# update(), so the Category signals (and the nav purge) don't fire.
+@receiver(post_save, sender=Outfit)
+@receiver(post_delete, sender=Outfit)
+def touch_outfit_categories(sender, instance, **kwargs):
+    category_ids = {instance.category_id, getattr(instance, '_previous_category_id', None)} - {None}
+    if category_ids:
+        Category.objects.filter(pk__in=category_ids).update(updated_at=timezone.now())
+
+
+# Incrementally maintain each outfit's rating summary
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, **kwargs):
+    instance._previous_rating = None
+    if instance.pk:
+        instance._previous_rating = (
+            Review.objects.filter(pk=instance.pk).values_list('outfit_id', 'rating').first()
+        )
+
+@receiver(post_save, sender=Review)
+def update_rating_summary(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_rating', None)
+    if previous == (instance.outfit_id, instance.rating):
+        return
+    if previous:
+        ratings.remove_rating(*previous)
+        purge_rated_outfit(previous[0])
+    ratings.add_rating(instance.outfit_id, instance.rating)
+    purge_rated_outfit(instance.outfit_id)
+
+@receiver(post_delete, sender=Review)
+def remove_from_rating_summary(sender, instance, **kwargs):
+    ratings.remove_rating(instance.outfit_id, instance.rating)
+    purge_rated_outfit(instance.outfit_id)
+
+def purge_rated_outfit(outfit_id):
+    # The summary is written with update(), so the Outfit signals above don't fire
+    category_id = Outfit.objects.filter(pk=outfit_id).values_list('category_id', flat=True).first()
+    page_cache.purge_outfit(outfit_id, category_id)
+
+
+# Category nav is cached under a version number; bump it on any change
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def bump_categories_version(sender, instance, **kwargs):
+    categories.bump_version()
+    # every page shows the nav, so this is the one change that clears them all
+    page_cache.purge('category_nav', 'category_list', f'category:{instance.pk}')
+
+
+# Cached cart totals include the outfit price
+@receiver(post_save, sender=Outfit)
+def invalidate_cart_summaries(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_price', None)
+    if not created and previous is not None and previous != instance.price:
+        cart.invalidate_for_outfit(instance.pk)
+
+@receiver(pre_delete, sender=Outfit)
+def invalidate_cart_summaries_on_delete(sender, instance, **kwargs):
+    # runs before the cascade removes the cart rows we need to find the users
+    cart.invalidate_for_outfit(instance.pk)
+
+
+# Resized/WebP copies of every newly uploaded image, made by run_media_workers
+IMAGE_FIELD_NAMES = dict(images.IMAGE_FIELDS)
+
+
+def make_image_derivatives(sender, instance, **kwargs):
+    name = getattr(instance, IMAGE_FIELD_NAMES[sender]).name
+    # derivatives() is cached, so re-saving an unchanged image costs no query
+    if name and not any(images.derivatives(name).values()):
+        jobs.enqueue('derivatives', name)
+
+for image_model in IMAGE_FIELD_NAMES:
+    post_save.connect(make_image_derivatives, sender=image_model, dispatch_uid=f'image_derivatives_{image_model.__name__}')
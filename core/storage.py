@@ -0,0 +1,72 @@
+"""
+Content-addressed media storage.
+
+Files are stored under the SHA-256 of their bytes in one shared pool, so
+outfits/hero1.jpg becomes files/ab/<hash>.jpg whatever it was uploaded as.
+Uploading the same photo again, for an outfit or a category, returns the
+existing name instead of writing a suffixed copy, and since a name can
+never point at different bytes, media
+URLs are served with a far-future immutable Cache-Control (serve_media()
+in development; the web server should do the same for /media/ in
+production).
+
+Files stored before this are moved over by the dedupe_media command.
+"""
+import hashlib
+import posixpath
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.views.static import serve
+
+HASHED_DIR = 'files'
+HASH_LENGTH = 32
+# the same bytes shouldn't get two names just because of how the extension was typed
+EXTENSIONS = {'.jpeg': '.jpg', '.jpe': '.jpg', '.tif': '.tiff'}
+HASHED_NAME = re.compile(rf'^{HASHED_DIR}/[0-9a-f]{{2}}/[0-9a-f]{{{HASH_LENGTH}}}(\.[a-z0-9]+)?$')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def content_hash(content):
+    """Hex digest naming a File's bytes; chunks() rewinds it first."""
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def is_hashed(name):
+    return bool(HASHED_NAME.match(name or ''))
+
+
+def hashed_name(name, digest):
+    ext = posixpath.splitext(name)[1].lower()
+    # sharded on the first two characters to keep directories small
+    return f'{HASHED_DIR}/{digest[:2]}/{digest}{EXTENSIONS.get(ext, ext)}'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def __init__(self, **kwargs):
+        # a second writer of the same name is writing the same bytes
+        kwargs.setdefault('allow_overwrite', True)
+        super().__init__(**kwargs)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = hashed_name(name, content_hash(content))
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+def serve_media(request, path, document_root=None):
+    """django.views.static.serve, plus immutable caching for content-addressed files."""
+    response = serve(request, path, document_root=document_root)
+    if is_hashed(path):
+        response['Cache-Control'] = IMMUTABLE
+    return response
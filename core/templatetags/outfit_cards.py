@@ -0,0 +1,11 @@
+from django import template
+
+from core.cards import render_cards
+
+register = template.Library()
+
+
+@register.simple_tag
+def cached_cards(outfits, template_name):
+    """{% cached_cards outfits 'core/partials/outfit_card_body.html' as cards %}"""
+    return render_cards(outfits, template_name)
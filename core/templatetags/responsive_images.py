@@ -0,0 +1,69 @@
+from django import template
+from django.urls import reverse
+from django.utils.html import format_html
+
+from core import resize
+from core.images import derivatives
+from core.placeholders import placeholder
+
+register = template.Library()
+
+
+def placeholder_style(image):
+    """Inline background showing the image's blurred preview until it loads."""
+    found = placeholder(image.name)
+    if not found:
+        return ''
+    data_uri, color = found
+    return f'background:{color} url({data_uri}) center / 100% 100% no-repeat'
+
+
+def srcset(candidates):
+    return ', '.join(f'{url} {width}w' for url, width in candidates)
+
+
+@register.simple_tag
+def responsive_image(image, alt='', sizes='100vw', css_class='', loading='lazy'):
+    """
+    {% responsive_image outfit.image alt=outfit.name sizes="(max-width: 600px) 50vw, 320px" css_class="outfit-image" %}
+
+    A <picture> offering the WebP derivatives with JPEG as the fallback; a
+    plain <img> of the original until its derivatives exist. Either way the
+    <img> shows the image's placeholder, if made, while it loads.
+    """
+    if not image:
+        return ''
+    found = derivatives(image.name)
+    jpeg, webp = found.get('jpeg'), found.get('webp')
+    style = placeholder_style(image)
+    if not jpeg:
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" loading="{}" style="{}">', image.url, alt, css_class, loading, style,
+        )
+
+    # src for browsers without srcset: the first derivative big enough for a card
+    fallback = next((url for url, width in jpeg if width >= 640), jpeg[-1][0])
+    webp_source = format_html(
+        '<source type="image/webp" srcset="{}" sizes="{}">', srcset(webp), sizes,
+    ) if webp else ''
+    return format_html(
+        '<picture class="responsive-picture">{}<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="{}" style="{}"></picture>',
+        webp_source, fallback, srcset(jpeg), sizes, alt, css_class, loading, style,
+    )
+
+
+@register.simple_tag
+def resized_url(image, size):
+    """
+    {% resized_url outfit.image "96x96" %}
+
+    URL of the image resized on demand (see core.resize); "600x0" keeps
+    the aspect ratio, both sides set crops to fill. The size must be one
+    of resize.SIZES, which is all the endpoint serves.
+    """
+    if size not in resize.SIZES:
+        raise ValueError(f"{size} isn't in resize.SIZES")
+    if not image:
+        return ''
+    width, height = (int(side) for side in size.split('x'))
+    return reverse('resized_image', args=[width, height, image.name])
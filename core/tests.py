@@ -1,3 +1,177 @@
-from django.test import TestCase
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+
+from . import inventory
+from .models import Cart, Category, Outfit, Profile
+from .orders import place_order
+
+
+class CheckoutConcurrencyTests(TransactionTestCase):
+    """
+    Many threads check out at once against one stock-tracked outfit. Each
+    thread has its own connection to the file-backed test database (see
+    DATABASES['default']['TEST']), so the checkouts really do race.
+    """
+    threads = 8
+    shoppers = 40
+    stock = 20
+
+    def create_shoppers(self, outfit, quantity):
+        with transaction.atomic():
+            User.objects.bulk_create([User(username=f'shopper-{i}') for i in range(self.shoppers)])
+            users = list(User.objects.filter(username__startswith='shopper-'))
+            # bulk_create skips the signal that normally creates profiles
+            Profile.objects.bulk_create([Profile(user=user) for user in users], ignore_conflicts=True)
+            Cart.objects.bulk_create([Cart(user=user, outfit=outfit, quantity=quantity) for user in users])
+        return list(User.objects.filter(pk__in=[user.pk for user in users]).select_related('profile'))
+
+    def race(self, users):
+        chunks = [users[i::self.threads] for i in range(self.threads) if users[i::self.threads]]
+        start = threading.Barrier(len(chunks))
+
+        def checkout(user):
+            try:
+                order, created = place_order(user, idempotency_key=uuid.uuid4().hex)
+                return 'ordered' if created else 'empty'
+            except inventory.OutOfStock:
+                return 'out_of_stock'
+            except Exception as e:
+                return f'error: {e.__class__.__name__}: {e}'
+
+        def worker(chunk):
+            try:
+                start.wait()  # line the first wave up so they really collide
+                return [checkout(user) for user in chunk]
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+            outcomes = [outcome for result in pool.map(worker, chunks) for outcome in result]
+        counts = {}
+        for outcome in outcomes:
+            counts[outcome] = counts.get(outcome, 0) + 1
+        return counts
+
+    def check_no_oversell(self, quantity=1, reserve=False):
+        outfit = Outfit.objects.create(name='Contested', price=100, stock=self.stock, is_active=False)
+        users = self.create_shoppers(outfit, quantity)
+        if reserve:
+            for user in users:
+                inventory.reserve_cart(user, list(Cart.objects.filter(user=user).select_related('outfit')))
+
+        counts = self.race(users)
+        outfit.refresh_from_db()
+        ordered = counts.get('ordered', 0)
+        expected = min(self.stock // quantity, self.shoppers)
+
+        self.assertEqual([outcome for outcome in counts if outcome.startswith('error')], [])
+        self.assertEqual(ordered, expected)
+        self.assertEqual(counts.get('out_of_stock', 0), self.shoppers - expected)
+        self.assertEqual(outfit.stock, self.stock - ordered * quantity)
+        self.assertEqual(outfit.reserved, 0)
+
+    def test_concurrent_checkouts_never_oversell(self):
+        self.check_no_oversell()
+
+    def test_multi_unit_lines_never_oversell(self):
+        self.check_no_oversell(quantity=3)
+
+    def test_reserved_carts_never_oversell(self):
+        self.check_no_oversell(reserve=True)
+
+
+class PageCachePurgeTests(TestCase):
+    """Saving one outfit must only purge the pages that show it."""
+
+    def setUp(self):
+        cache.clear()
+        self.shoes = Category.objects.create(name='Shoes', slug='shoes')
+        self.bags = Category.objects.create(name='Bags', slug='bags')
+        self.boot = Outfit.objects.create(name='Boot', price=100, category=self.shoes)
+        self.tote = Outfit.objects.create(name='Tote', price=80, category=self.bags)
+        self.bag_page = reverse('category_detail', args=['bags'])
+        self.tote_page = reverse('outfit_detail', args=[self.tote.pk])
+
+    def cache_status(self, url):
+        return self.client.get(url)['X-Page-Cache']
+
+    def test_outfit_save_keeps_unrelated_pages(self):
+        shoe_page = reverse('category_detail', args=['shoes'])
+        for url in (self.bag_page, self.tote_page, reverse('about'), shoe_page):
+            self.cache_status(url)
+        self.boot.price = 90
+        self.boot.save()
+        self.assertEqual(self.cache_status(self.bag_page), 'hit')
+        self.assertEqual(self.cache_status(self.tote_page), 'hit')
+        self.assertEqual(self.cache_status(reverse('about')), 'hit')
+        self.assertEqual(self.cache_status(shoe_page), 'miss')
+
+    def test_category_save_purges_every_page_with_the_nav(self):
+        for url in (self.bag_page, self.tote_page, reverse('about')):
+            self.cache_status(url)
+        self.shoes.name = 'Footwear'
+        self.shoes.save()
+        for url in (self.bag_page, self.tote_page, reverse('about')):
+            self.assertEqual(self.cache_status(url), 'miss')
+
+
+class CategoryLastModifiedTests(TestCase):
+    """A category page's Last-Modified never goes back when its newest outfit leaves."""
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Dresses', slug='dresses')
+        older = Outfit.objects.create(name='Older', price=100, category=self.category)
+        self.newest = Outfit.objects.create(name='Kitenge wrap dress', price=100, category=self.category)
+        now = timezone.now()
+        Category.objects.filter(pk=self.category.pk).update(updated_at=now - timedelta(hours=2))
+        Outfit.objects.filter(pk=older.pk).update(updated_at=now - timedelta(hours=1))
+        Outfit.objects.filter(pk=self.newest.pk).update(updated_at=now - timedelta(minutes=10))
+        self.url = reverse('category_detail', args=['dresses'])
+        self.last_modified = self.client.get(self.url)['Last-Modified']
+        self.assertEqual(self.last_modified, http_date((now - timedelta(minutes=10)).timestamp()))
+
+    def assert_page_changed(self):
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=self.last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'Kitenge wrap dress')
+
+    def test_deactivating_the_newest_outfit(self):
+        self.newest.is_active = False
+        self.newest.save()
+        self.assert_page_changed()
+
+    def test_deleting_the_newest_outfit(self):
+        self.newest.delete()
+        self.assert_page_changed()
+
+    def test_moving_the_newest_outfit(self):
+        self.newest.category = Category.objects.create(name='Shoes', slug='shoes')
+        self.newest.save()
+        self.assert_page_changed()
+
+
+class OutfitCardCacheTests(TestCase):
+    def test_designer_rename_shows_on_cached_cards(self):
+        cache.clear()
+        designer = User.objects.create(username='amina')
+        category = Category.objects.create(name='Dresses', slug='dresses')
+        Outfit.objects.create(name='Wrap dress', price=100, category=category, designer=designer.profile)
+        url = reverse('category_detail', args=['dresses'])
+        self.assertContains(self.client.get(url), 'By amina')
+
+        designer.username = 'amina_designs'
+        designer.save()
+        # a signed-in visitor skips the page cache, so only the card cache is in play
+        self.client.force_login(User.objects.create(username='shopper'))
+        self.assertContains(self.client.get(url), 'By amina_designs')
@@ -6,6 +6,8 @@ from .views import CategoryListView, CategoryDetailView, add_to_cart, toggle_wis
 urlpatterns = [
     # Home / Outfit
     path('', views.OutfitListView.as_view(), name='outfit_list'),
+    path('outfits/feed/', views.outfit_feed, name='outfit_feed'),
+    path('search/', views.SearchView.as_view(), name='search'),
     path('outfit/<int:pk>/', views.OutfitDetailView.as_view(), name='outfit_detail'),
     path('outfit/add/', views.OutfitCreateView.as_view(), name='add_outfit'),
     path('outfit/<int:pk>/edit/', views.OutfitUpdateView.as_view(), name='edit_outfit'),
@@ -28,11 +30,19 @@ urlpatterns = [
     path('cart/add/<int:outfit_id>/', views.add_to_cart, name='add_to_cart'),
     path('cart/', views.view_cart, name='cart_detail'),   # Your cart page
     path('checkout/', views.checkout, name='checkout'),     # Checkout logic
+    path("orders/", views.order_history, name="order_history"),
     path("order/<int:order_id>/", views.order_detail, name="order_detail"),
+    path("order/<int:order_id>/pay/", views.pay_order, name="pay_order"),
+    path("order/<int:order_id>/payment-status/", views.payment_status, name="payment_status"),
+    path("payments/mpesa/callback/<str:token>/", views.mpesa_callback, name="mpesa_callback"),
+    # ahead of the media files in development; proxy /media/r/ to Django in production
+    path("media/r/stats/", views.resize_stats, name="resize_stats"),
+    path("media/r/<int:width>x<int:height>/<path:path>", views.resized_image, name="resized_image"),
     path('order-confirmation/<int:order_id>/', views.order_confirmation, name='order_confirmation'),
 
 
     path('add-to-cart/', add_to_cart, name='add_to_cart'),
+    path("cart/batch/", views.batch_cart, name="batch_cart"),
     path("cart/remove/<int:item_id>/", views.remove_cart_item, name="remove_cart_item"),
     path("cart/increase/<int:item_id>/", views.increase_cart_item, name="increase_cart_item"),
     path("cart/decrease/<int:item_id>/", views.decrease_cart_item, name="decrease_cart_item"),
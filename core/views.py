@@ -1,4 +1,8 @@
+import json
+import uuid
+
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
 from django.views import View
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.urls import reverse_lazy
@@ -9,16 +13,22 @@ from django.contrib.auth import login, authenticate, logout
 from django.contrib import messages
 from django.utils import timezone
 from django.contrib.auth.forms import AuthenticationForm
-from django.db.models import Count, Avg
-from django.views.decorators.http import require_POST
-from django.http import JsonResponse
-from django.db import models
+from django.db.models import Count, Q, Prefetch
+from django.views.decorators.http import require_POST, condition
+from django.views.decorators.csrf import csrf_exempt
+from django.http import FileResponse, Http404, HttpResponseNotModified, JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.contrib.admin.views.decorators import staff_member_required
 from django.core.exceptions import ValidationError
 
 
 
-from .models import Profile, Category, Outfit, OutfitImage, Order, OrderItem, Review, Notification, Message, Cart, Wishlist, Compare, Review
+from .models import Profile, Category, Outfit, OutfitImage, Order, Review, Notification, Message, Cart, Wishlist, Compare, Review
 from .forms import SignUpForm, ProfileForm, OutfitForm, OutfitImageForm, CategoryForm, ReviewForm, MessageForm, ReviewForm
+from .pagination import keyset_paginate
+from .search import SearchResults
+from . import facets, conditional, cart, orders, inventory, payments, resize, storage
+from .page_cache import cache_anonymous_page
 
 
 # -------------------------
@@ -33,9 +43,11 @@ def user_signup(request):
             user.profile.is_seller = False
             user.profile.save()
             
+            guest_cart = cart.GuestCart(request)
             login(request, user)
+            cart.merge_guest_cart(guest_cart, user)
             messages.success(request, "Account created successfully.")
-            return redirect('outfit_list')
+            return guest_cart.save(redirect('outfit_list'))
         else:
             messages.error(request, "Please correct the errors below.")
     else:
@@ -48,10 +60,13 @@ def user_login(request):
         form = AuthenticationForm(request, data=request.POST)
         if form.is_valid():
             user = form.get_user()
+            guest_cart = cart.GuestCart(request)
             login(request, user)
+            # Anything put in the cart before logging in carries over
+            cart.merge_guest_cart(guest_cart, user)
             messages.success(request, "Login successful.")
             # redirect to homepage (outfit_list)
-            return redirect('outfit_list')
+            return guest_cart.save(redirect('outfit_list'))
         else:
             messages.error(request, "Invalid username or password.")
     else:
@@ -84,24 +99,91 @@ class ProfileView(LoginRequiredMixin, View):
 
 # OUTFIT
 # -------------------------
+def card_user_state(user):
+    """Wishlist/compare ids for the per-user part of outfit cards (the rest is cached)."""
+    if not user.is_authenticated:
+        return {}
+    return {
+        'wishlist_ids': set(Wishlist.objects.filter(user=user).values_list('outfit_id', flat=True)),
+        'compare_ids': set(Compare.objects.filter(user=user).values_list('outfit_id', flat=True)),
+    }
+
+
+def outfit_feed_queryset():
+    # designer__user and category are read by every card, so join them up front
+    return Outfit.objects.filter(is_active=True).select_related('designer__user', 'category')
+
+
+@method_decorator(cache_anonymous_page(
+    params=('cursor',), tags=lambda request, response, **kwargs: ['outfits', 'category_nav'],
+), name='dispatch')
 class OutfitListView(ListView):
     model = Outfit
     template_name = 'core/outfit_list.html'
     context_object_name = 'outfits'
+    page_size = 24
 
     def get_queryset(self):
-        return Outfit.objects.filter(is_active=True).order_by('-created_at')
+        self.page = keyset_paginate(
+            outfit_feed_queryset(), self.request.GET.get('cursor'), self.page_size
+        )
+        return self.page.object_list
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        from .models import Category   # import here or at the top
-        context['categories'] = Category.objects.all()  # pass categories to template
+        # categories come from the cached categories_processor
+        context['page'] = self.page
+        context['is_first_page'] = not self.request.GET.get('cursor')
+        context.update(card_user_state(self.request.user))
         return context
 
 
+def outfit_feed(request):
+    """
+    Next page of outfit cards for infinite scroll.
+    Returns the rendered cards plus the cursor for the page after them.
+    """
+    page = keyset_paginate(
+        outfit_feed_queryset(), request.GET.get('cursor'), OutfitListView.page_size
+    )
+    html = render_to_string(
+        'core/partials/outfit_cards.html',
+        {'outfits': page, **card_user_state(request.user)},
+        request=request,
+    )
+    return JsonResponse({
+        'html': html,
+        'count': len(page),
+        'next_cursor': page.next_cursor,
+        'has_next': page.has_next,
+    })
+
+
   
 
 
+class SearchView(ListView):
+    template_name = 'core/search.html'
+    context_object_name = 'outfits'
+    paginate_by = 24
+
+    def get_queryset(self):
+        self.query = self.request.GET.get('q', '').strip()
+        return SearchResults(self.query)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['query'] = self.query
+        context.update(card_user_state(self.request.user))
+        return context
+
+
+@method_decorator(condition(
+    etag_func=conditional.outfit_etag, last_modified_func=conditional.outfit_last_modified,
+), name='dispatch')
+@method_decorator(cache_anonymous_page(
+    tags=lambda request, response, **kwargs: [f"outfit:{kwargs['pk']}", 'category_nav'],
+), name='dispatch')
 class OutfitDetailView(DetailView):
     model = Outfit
     template_name = 'core/outfit_detail.html'
@@ -159,19 +241,40 @@ class OutfitDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
         return super().delete(request, *args, **kwargs)
 
 
+@method_decorator(cache_anonymous_page(
+    tags=lambda request, response, **kwargs: ['category_list', 'category_nav'],
+), name='dispatch')
 class CategoryListView(ListView):
     model = Category
     template_name = 'core/category_list.html'
     context_object_name = 'categories'
+    preview_size = 4
     
     def get_queryset(self):
-        return Category.objects.all().prefetch_related('outfit_set')
+        # Only the newest few outfits per category; the sliced Prefetch is limited
+        # per category with ROW_NUMBER() in SQL, so big categories cost no more memory
+        previews = Outfit.objects.filter(is_active=True).only(
+            'id', 'name', 'image', 'category_id', 'created_at'
+        ).order_by('-created_at', '-id')[:self.preview_size]
+        return Category.objects.annotate(
+            active_outfit_count=Count('outfit', filter=Q(outfit__is_active=True))
+        ).prefetch_related(
+            Prefetch('outfit_set', queryset=previews, to_attr='preview_outfits')
+        ).order_by('pk')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['featured_categories'] = Category.objects.filter(featured=True)[:3]
+        # Featured ones are picked from the list already loaded, not a second query
+        context['featured_categories'] = [c for c in context['categories'] if c.featured][:3]
         return context
 
+@method_decorator(condition(
+    etag_func=conditional.category_etag, last_modified_func=conditional.category_last_modified,
+), name='dispatch')
+@method_decorator(cache_anonymous_page(
+    params=('sort', 'price') + facets.FACET_FIELDS,
+    tags=lambda request, response, **kwargs: [f"category:{response.context_data['category'].pk}", 'category_nav'],
+), name='dispatch')
 class CategoryDetailView(DetailView):
     model = Category
     template_name = 'core/category_detail.html'
@@ -185,7 +288,11 @@ class CategoryDetailView(DetailView):
         outfits = Outfit.objects.filter(
             category=category, 
             is_active=True
-        ).select_related('designer')
+        ).select_related('designer__user')
+
+        # Facet filters (brand, color, size, material, price range)
+        selected = facets.selected_filters(self.request.GET)
+        outfits = facets.apply_filters(outfits, selected)
         
         # Add sorting functionality
         sort = self.request.GET.get('sort', 'newest')
@@ -194,36 +301,47 @@ class CategoryDetailView(DetailView):
         elif sort == 'price_high':
             outfits = outfits.order_by('-price')
         elif sort == 'popular':
-            outfits = outfits.annotate(
-                num_orders=Count('orderitem')
-            ).order_by('-num_orders')
+            outfits = outfits.order_by('-order_count', '-units_sold')
         else:  # newest
             outfits = outfits.order_by('-created_at')
             
         context['outfits'] = outfits
         context['sort'] = sort
+        context['facets'] = facets.build_facets(category.pk, selected)
+        context['has_filters'] = any(selected.values())
+        # current filters as a query string, so sort links keep them
+        filter_params = self.request.GET.copy()
+        filter_params.pop('sort', None)
+        context['filter_query'] = filter_params.urlencode()
         return context
     
 
 # CART & ORDER
-@login_required
 def view_cart(request):
-    cart_items = Cart.objects.filter(user=request.user)  # Fetch items for logged-in user
-    total = sum(item.total_price for item in cart_items)
+    store = cart.get_cart(request)
+    items = list(store.items())  # outfits joined, subtotals computed up front
+    summary = store.summary(items)
+    short = []
+    if request.user.is_authenticated:
+        # Hold the stock for this cart while the shopper heads to checkout
+        short = inventory.reserve_cart(request.user, items)
 
     return render(request, 'core/cart.html', {
-        'items': cart_items,
-        'total': total
+        'items': items,
+        'subtotal': summary['total'],
+        'total': summary['total'],
+        'checkout_key': uuid.uuid4().hex,
+        'short_ids': {outfit.pk for outfit in short},
     })
 
 
 @require_POST
-@login_required
 def add_to_cart(request, outfit_id=None):
     """
     Universal Add to Cart view:
     - Supports outfit_id from URL or POST data
     - Works for all 'Add to Cart' buttons in the project
+    - Guests get a cookie-backed cart, merged into their account on login
     """
     # Get outfit_id (from URL param OR POST body)
     if outfit_id is None:
@@ -245,84 +363,84 @@ def add_to_cart(request, outfit_id=None):
     # Try fetching outfit and updating cart
     try:
         outfit = Outfit.objects.get(id=outfit_id)
-        cart_item, created = Cart.objects.get_or_create(
-            user=request.user,
-            outfit=outfit,
-            defaults={'quantity': quantity}
-        )
+    except (Outfit.DoesNotExist, ValueError):
+        return JsonResponse({'success': False, 'message': 'Outfit not found'}, status=404)
 
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
+    store = cart.get_cart(request)
+    try:
+        store.add(outfit, quantity)
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'message': e.messages[0]}, status=400)
 
-        # total cart items (sum of quantities)
-        cart_count = Cart.objects.filter(user=request.user).aggregate(
-            total=models.Sum('quantity')
-        )['total'] or 0
+    return store.save(redirect('view_cart'))
 
-        return redirect('view_cart')
 
-    except Outfit.DoesNotExist:
-        return JsonResponse({'success': False, 'message': 'Outfit not found'}, status=404)
+def remove_cart_item(request, item_id):
+    if request.method != "POST":
+        return JsonResponse({"success": False}, status=400)
+    store = cart.get_cart(request)
+    try:
+        summary = store.remove(item_id)
+    except Cart.DoesNotExist:
+        raise Http404("Cart item not found")
+    return store.save(JsonResponse({"success": True, "item_id": item_id, "cart_total": str(summary['total'])}))
 
 
+def change_cart_item(request, item_id, delta):
+    if request.method != "POST":
+        return JsonResponse({"success": False, "error": "Invalid request"}, status=400)
+    store = cart.get_cart(request)
+    try:
+        line, summary = store.change(item_id, delta)
+    except Cart.DoesNotExist:
+        raise Http404("Cart item not found")
+    except ValidationError as e:
+        return JsonResponse({"success": False, "error": e.messages[0]}, status=400)
+    return store.save(JsonResponse({
+        "success": True,
+        "quantity": line.quantity if line else 0,
+        "subtotal": str(line.line_total) if line else "0.00",
+        "cart_total": str(summary['total'])
+    }))
 
-def remove_cart_item(request, item_id):
-    if request.method == "POST":
-        item = get_object_or_404(Cart, id=item_id)
-        item.delete()
-        return JsonResponse({"success": True, "item_id": item_id})
-    return JsonResponse({"success": False}, status=400)
+
+@require_POST
+def batch_cart(request):
+    """
+    Apply several cart operations in one request, e.g. the debounced +/-
+    clicks from the cart page:
+    {"operations": [{"op": "set", "outfit": 12, "quantity": 3},
+                    {"op": "add", "outfit": 5, "quantity": 1},
+                    {"op": "remove", "outfit": 7}]}
+    """
+    try:
+        payload = json.loads(request.body or b'{}')
+        operations = cart.parse_operations(payload.get('operations') if isinstance(payload, dict) else None)
+    except ValueError:
+        return JsonResponse({"success": False, "error": "Invalid JSON"}, status=400)
+    except ValidationError as e:
+        return JsonResponse({"success": False, "error": e.messages[0]}, status=400)
+
+    store = cart.get_cart(request)
+    try:
+        lines, summary = store.batch(operations)
+    except ValidationError as e:
+        return JsonResponse({"success": False, "error": e.messages[0]}, status=400)
+    return store.save(JsonResponse({
+        "success": True,
+        "lines": lines,
+        "cart_count": summary['lines'],
+        "cart_quantity": summary['quantity'],
+        "cart_total": str(summary['total'])
+    }))
 
 
-@login_required
 def increase_cart_item(request, item_id):
-    if request.method == "POST":
-        item = get_object_or_404(Cart, id=item_id, user=request.user)
-        try:
-            # Optional: Add stock check if Outfit has 'stock' field
-            if hasattr(item.outfit, 'stock') and item.quantity + 1 > item.outfit.stock:
-                return JsonResponse({"success": False, "error": f"Only {item.outfit.stock} in stock."}, status=400)
-            item.quantity += 1
-            item.save()
-            cart_total = sum(i.total_price for i in Cart.objects.filter(user=request.user))
-            return JsonResponse({
-                "success": True,
-                "quantity": item.quantity,
-                "subtotal": str(item.total_price),  # Fixed: Use total_price
-                "cart_total": str(cart_total)
-            })
-        except ValidationError as e:
-            return JsonResponse({"success": False, "error": str(e)}, status=400)
-    return JsonResponse({"success": False, "error": "Invalid request"}, status=400)
+    return change_cart_item(request, item_id, 1)
+
 
-@login_required
 def decrease_cart_item(request, item_id):
-    if request.method == "POST":
-        item = get_object_or_404(Cart, id=item_id, user=request.user)
-        try:
-            if item.quantity > 1:
-                item.quantity -= 1
-                item.save()
-            else:
-                # Optional: Delete if quantity would be 0
-                item.delete()
-                return JsonResponse({
-                    "success": True,
-                    "quantity": 0,
-                    "subtotal": "0.00",
-                    "cart_total": str(sum(i.total_price for i in Cart.objects.filter(user=request.user)))
-                })
-            cart_total = sum(i.total_price for i in Cart.objects.filter(user=request.user))
-            return JsonResponse({
-                "success": True,
-                "quantity": item.quantity,
-                "subtotal": str(item.total_price),  # Fixed: Use total_price
-                "cart_total": str(cart_total)
-            })
-        except ValidationError as e:
-            return JsonResponse({"success": False, "error": str(e)}, status=400)
-    return JsonResponse({"success": False, "error": "Invalid request"}, status=400)
+    return change_cart_item(request, item_id, -1)
 
 
 @require_POST
@@ -416,51 +534,124 @@ def Wishlist_page(request):
 
 
 @login_required
+@require_POST
 def checkout(request):
-    user = request.user  
-    cart_items = Cart.objects.filter(user=user)
+    # The cart page's form posts a fresh key per visit; a repeated or retried
+    # submit with the same key lands on the order that was already placed
+    idempotency_key = request.POST.get('idempotency_key') or request.headers.get('Idempotency-Key')
+    try:
+        order, created = orders.place_order(request.user, idempotency_key=idempotency_key)
+    except inventory.OutOfStock as e:
+        messages.error(request, str(e))
+        return redirect("cart_detail")
 
-    if not cart_items.exists():
+    if order is None:
         messages.error(request, "Your cart is empty.")
         return redirect("cart_detail")
 
-    # Calculate total
-    total_amount = sum(item.outfit.price * item.quantity for item in cart_items)
+    if created:
+        messages.success(request, f"Order #{order.pk} has been placed successfully!")
+    return redirect("order_detail", order_id=order.id)  # take them to order summary
+
 
-    # Create order
-    order = Order.objects.create(
-        customer=user.profile,
-        total_amount=total_amount,
-        payment_method="mpesa"  # later you can let user choose
+@login_required
+def order_history(request):
+    # Cursor pagination on (created_at, id)
+    # Lines come from each order's receipt snapshot, so a page is a single query
+    page = keyset_paginate(
+        Order.objects.filter(customer=request.user.profile),
+        cursor=request.GET.get('cursor'),
+        page_size=10,
     )
+    return render(request, "core/order_history.html", {
+        "page": page,
+        "orders": page.object_list,
+        "is_first_page": not request.GET.get('cursor'),
+    })
 
-    # Create OrderItems
-    for item in cart_items:
-        OrderItem.objects.create(
-            order=order,
-            outfit=item.outfit,
-            quantity=item.quantity,
-            price=item.outfit.price
-        )
 
-    # Clear cart
-    cart_items.delete()
+@login_required
+def order_detail(request, order_id):
+    # Rendered from the receipt snapshot alone; no OrderItem/Outfit queries
+    order = get_object_or_404(Order, id=order_id, customer=request.user.profile)
+    payment = order.payment_attempts.order_by('-created_at').first() if order.status == 'pending' else None
+    return render(request, "core/order_detail.html", {
+        "order": order,
+        "payment": payment,
+        "default_phone": request.user.profile.phone,
+    })
 
-    messages.success(request, f"Order #{order.pk} has been placed successfully!")
-    return redirect("order_detail", order_id=order.id)  # take them to order summary
+
+@require_POST
+@login_required
+def pay_order(request, order_id):
+    order = get_object_or_404(Order, id=order_id, customer=request.user.profile)
+    try:
+        # Only queues the STK push; the gateway is called off the request thread
+        payments.start_payment(order, request.POST.get('phone') or request.user.profile.phone)
+    except ValidationError as e:
+        messages.error(request, e.messages[0])
+    else:
+        messages.info(request, "Check your phone and enter your M-Pesa PIN to complete the payment.")
+    return redirect("order_detail", order_id=order.id)
 
 
 @login_required
-def order_detail(request, order_id):
-    order = Order.objects.get(id=order_id, customer=request.user.profile)
-    return render(request, "core/order_detail.html", {"order": order})
+def payment_status(request, order_id):
+    order = get_object_or_404(Order.objects.only('id', 'status'), id=order_id, customer=request.user.profile)
+    payment = order.payment_attempts.order_by('-created_at').values('status', 'result_description').first()
+    return JsonResponse({
+        "order_status": order.status,
+        "payment_status": payment['status'] if payment else None,
+        "message": payment['result_description'] if payment else "",
+    })
+
+
+@csrf_exempt
+@require_POST
+def mpesa_callback(request, token):
+    try:
+        handled = payments.handle_callback(token, json.loads(request.body))
+    except (ValueError, ValidationError):
+        return JsonResponse({"ResultCode": 1, "ResultDesc": "Rejected"}, status=400)
+    if not handled:
+        raise Http404("Unknown payment")
+    return JsonResponse({"ResultCode": 0, "ResultDesc": "Accepted"})
 
 
 def order_confirmation(request, order_id):
-    order = get_object_or_404(Order, id=order_id)
+    order = get_object_or_404(Order.objects.select_related('customer__user'), id=order_id)
     return render(request, "core/order_confirmation.html", {"order": order})
 
 
+# -------------------------
+# RESIZED IMAGES
+# -------------------------
+def resized_image(request, width, height, path):
+    fmt = resize.pick_format(request.headers.get('Accept'))
+    try:
+        handle, key = resize.get(path, width, height, fmt)
+    except resize.ResizeError:
+        raise Http404("No such image or size")
+
+    etag = f'"{key}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        handle.close()
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(handle, content_type=resize.FORMATS[fmt]['content_type'])
+    response['ETag'] = etag
+    # a hashed name never changes content; other names are revalidated by ETag
+    response['Cache-Control'] = storage.IMMUTABLE if storage.is_hashed(path) else 'public, max-age=86400'
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+@staff_member_required
+def resize_stats(request):
+    return JsonResponse(resize.stats())
+
+
 # -------------------------
 # REVIEWS
 # -------------------------
@@ -548,24 +739,22 @@ class OutfitReviewsView(ListView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         outfit = get_object_or_404(Outfit, pk=self.kwargs['outfit_id'])
-        
-        reviews = self.get_queryset()
-        rating_stats = reviews.aggregate(
-            avg_rating=Avg('rating'),
-            count=Count('id')
-        )
-        
+
+        # Summary is maintained on the outfit row, no aggregate queries needed
         context.update({
             'outfit': outfit,
-            'average_rating': rating_stats['avg_rating'] or 0,
-            'review_count': rating_stats['count'],
-            'rating_distribution': reviews.values('rating').annotate(count=Count('id'))
+            'average_rating': outfit.average_rating,
+            'review_count': outfit.rating_count,
+            'rating_distribution': outfit.rating_histogram,
         })
         return context
 
+# the page itself is static, but the category nav in it isn't
+@cache_anonymous_page(timeout=60 * 60, tags=lambda request, response, **kwargs: ['category_nav'])
 def about_view(request):
     return render(request, 'core/about.html')
 
+@cache_anonymous_page(timeout=60 * 60, tags=lambda request, response, **kwargs: ['category_nav'])
 def contact_view(request):
     if request.method == 'POST':
         form = MessageForm(request.POST)
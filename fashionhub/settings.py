@@ -64,6 +64,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'core.context_processors.categories_processor',  # Custom context processor for categories
+                'core.context_processors.page_cache_csrf',  # CSRF placeholder for the anonymous page cache
             ],
         },
     },
@@ -79,6 +80,27 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock when a transaction starts, so concurrent
+            # checkouts queue up instead of failing with "database is locked"
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # A file, not the in-memory default, so the checkout concurrency
+        # tests' threads each get a real connection with real locking
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+    }
+}
+
+
+# Cache
+# Local memory by default; point this at Redis/Memcached in production so
+# cache invalidation (category nav, facet counts, ...) is shared by all workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fashionhub',
     }
 }
 
@@ -127,6 +149,25 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+STORAGES = {
+    # uploads are named by content hash, so duplicates are stored once
+    'default': {'BACKEND': 'core.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+# On-demand resizes (/media/r/<w>x<h>/...), kept on disk under an LRU cap
+RESIZE_CACHE_DIR = os.path.join(BASE_DIR, 'resize_cache')
+RESIZE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# the only sizes served: admin thumbnails, compare table, quick view
+RESIZE_SIZES = ['96x96', '0x360', '600x0']
+
+
+
+# M-Pesa STK push (see core.payments). The defaults point at the local stub
+# gateway: python manage.py mpesa_stub
+MPESA_GATEWAY_URL = os.environ.get('MPESA_GATEWAY_URL', 'http://127.0.0.1:8765')
+MPESA_CALLBACK_BASE_URL = os.environ.get('MPESA_CALLBACK_BASE_URL', 'http://127.0.0.1:8000')
+MPESA_SHORTCODE = os.environ.get('MPESA_SHORTCODE', '174379')
 
 
 # Authentication Redirects